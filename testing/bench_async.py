@@ -0,0 +1,79 @@
+# Echo round-trip latency over loopback, threaded WebsocketServer vs. AsyncWebsocketServer.
+# Each server runs in its own process; a blocking client sends small masked messages one at a time
+# and measures the time until the echo arrives.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+import socket, multiprocessing, time, base64
+
+ROUNDS = 5000
+PAYLOAD = b"x" * 32
+MASKKEY = b"\x37\xfa\x21\x3d"
+THREADED_PORT = 18090
+ASYNC_PORT = 18091
+
+def threaded_server(port, ready):
+    from websocket.server import WebsocketServer
+    server = WebsocketServer(on_message=lambda sess, message: sess.send(message))
+    server.listen("127.0.0.1", port)
+    ready.set()
+    time.sleep(3600)
+
+def async_server(port, ready):
+    from websocket import aio
+    async def echo(session):
+        async for message in session:
+            await session.send(message)
+    async def main():
+        server = aio.AsyncWebsocketServer(echo)
+        await server.listen("127.0.0.1", port)
+        ready.set()
+        await server.serve_forever()
+    aio.run(main())
+
+def connect(port):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    key = base64.b64encode(os.urandom(16))
+    sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n"
+                 b"Sec-WebSocket-Version: 13\r\nSec-WebSocket-Key: " + key + b"\r\n\r\n")
+    response = b""
+    while b"\r\n\r\n" not in response:
+        response += sock.recv(4096)
+    assert response.startswith(b"HTTP/1.1 101"), response
+    return sock
+
+def measure(port):
+    sock = connect(port)
+    payload = bytearray(PAYLOAD)
+    mask(payload, MASKKEY)
+    message = encode_header(c.OpcodeBinary, len(payload), maskkey=MASKKEY) + bytes(payload)
+    parser = FrameParser(unmask=False)
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        sock.sendall(message)
+        while not parser.feed(sock.recv(4096)):
+            pass
+        samples.append(time.perf_counter() - start)
+    sock.close()
+    samples.sort()
+    return samples[len(samples) // 2], samples[len(samples) * 99 // 100]
+
+def main():
+    print("%-12s %10s %10s" % ("server", "p50 us", "p99 us"))
+    for name, target, port in [("threaded", threaded_server, THREADED_PORT), ("asyncio", async_server, ASYNC_PORT)]:
+        ready = multiprocessing.Event()
+        proc = multiprocessing.Process(target=target, args=(port, ready), daemon=True)
+        proc.start()
+        ready.wait()
+        p50, p99 = measure(port)
+        proc.terminate()
+        proc.join()
+        print("%-12s %10.1f %10.1f" % (name, p50 * 1e6, p99 * 1e6))
+
+if __name__ == "__main__":
+    main()
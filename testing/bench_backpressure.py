@@ -0,0 +1,68 @@
+# Send-queue memory with a deliberately slow reader.
+# The application pushes messages to one session as fast as it can while the client reads 4 KiB every 5 ms.
+# Without a bound the queue grows with everything produced; with the "pause" policy the producer waits for
+# on_resume_writing, with "drop" the excess messages are discarded, and either way memory stays bounded.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket.server import WebsocketServer
+from bench_async import connect
+import socket, threading, time, tracemalloc
+
+PORT = 18094
+MESSAGES = 100000
+PAYLOAD = b"x" * 256
+LIMITS = (256 << 10, 64 << 10)
+
+def slow_reader(sock, stop):
+    while not stop.is_set():
+        try:
+            if not sock.recv(4096):
+                return
+        except OSError:
+            return
+        time.sleep(0.005)
+
+def run(name, port, write_limits, policy):
+    resume = threading.Event()
+    resume.set()
+    server = WebsocketServer(write_limits=write_limits, overflow_policy=policy,
+                             on_pause_writing=lambda sess: resume.clear(),
+                             on_resume_writing=lambda sess: resume.set())
+    server.listen("127.0.0.1", port)
+    client = connect(port)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stop = threading.Event()
+    reader = threading.Thread(target=slow_reader, args=(client, stop))
+    reader.start()
+    time.sleep(0.1)
+    sess = server.sessions[0]
+    tracemalloc.start()
+    sent = dropped = 0
+    peak_queue = 0
+    deadline = time.monotonic() + 2.0
+    while sent + dropped < MESSAGES and time.monotonic() < deadline:
+        if policy == "pause" and not resume.wait(deadline - time.monotonic()):
+            break
+        if sess.send(PAYLOAD):
+            sent += 1
+        else:
+            dropped += 1
+        peak_queue = max(peak_queue, len(sess._sendqueue) + sess._handed_off - sess._handed_queued)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    client.close()
+    reader.join()
+    server.close()
+    print("%-12s %10d %10d %14d %14d" % (name, sent, dropped, peak_queue >> 10, peak_memory >> 10))
+
+def main():
+    print("%-12s %10s %10s %14s %14s" % ("policy", "queued", "dropped", "peak queue KiB", "peak mem KiB"))
+    # a port per run: closing the server leaves the previous run's connections in TIME_WAIT
+    run("unbounded", PORT, (float("inf"), float("inf")), "pause")
+    run("pause", PORT + 1, LIMITS, "pause")
+    run("drop", PORT + 2, LIMITS, "drop")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Fan-out throughput: one message pushed to every one of many loopback sessions.
+# broadcast() encodes the frame once and queues views of it, the naive loop calls session.send()
+# for every recipient. Each run times queueing the messages plus flushing every send queue out,
+# while a separate client process keeps reading from all connections.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket.server import WebsocketServer
+from bench_async import connect
+from bench_dispatch import raise_fd_limit
+import multiprocessing, selectors, time
+
+PORT = 18096
+SESSIONS = 10000
+MESSAGES = 20
+PAYLOAD = b'{"symbol":"ACME","bid":101.25,"ask":101.27,"ts":1700000000123}'
+
+def clients(port, count, ready, stop):
+    raise_fd_limit()
+    socks = [connect(port) for _ in range(count)]
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        sock.setblocking(0)
+        selector.register(sock, selectors.EVENT_READ)
+    ready.set()
+    while not stop.is_set():
+        for key, _ in selector.select(0.1):
+            try:
+                key.fileobj.recv(65536)
+            except BlockingIOError:
+                pass
+    for sock in socks:
+        sock.close()
+
+def wait_flushed(server):
+    while server._handoffs or any(len(sess._sendqueue) for sess in server.sessions):
+        time.sleep(0.001)
+
+def naive(server):
+    for sess in server.sessions:
+        sess.send(PAYLOAD)
+
+def fanout(server):
+    server.broadcast(PAYLOAD)
+
+def main():
+    limit = raise_fd_limit()
+    count = min(SESSIONS, limit - 100)
+    server = WebsocketServer()
+    server.listen("127.0.0.1", PORT, backlog=1024)
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    client = multiprocessing.Process(target=clients, args=(PORT, count, ready, stop))
+    client.start()
+    ready.wait()
+    while len(server.sessions) < count:
+        time.sleep(0.01)
+    print("%d sessions, %d messages of %d bytes" % (count, MESSAGES, len(PAYLOAD)))
+    print("%-12s %16s" % ("", "deliveries/s"))
+    for name, fn in [("naive loop", naive), ("broadcast", fanout)]:
+        start = time.perf_counter()
+        for _ in range(MESSAGES):
+            fn(server)
+        wait_flushed(server)
+        elapsed = time.perf_counter() - start
+        print("%-12s %16.0f" % (name, count * MESSAGES / elapsed))
+    stop.set()
+    client.join()
+    server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Write coalescing: echo throughput of the threaded server over loopback for small messages, writing every
+# frame right away vs. corking (frames packed into one buffer and written once per loop iteration), and
+# corking with a 1 ms flush delay. Each server runs in its own process; the client keeps a window of masked
+# messages in flight and counts the echoes.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+from bench_async import connect
+import multiprocessing, time
+
+MESSAGES = 50000
+WINDOW = 256
+SIZES = [32, 64, 128, 256, 512]
+MASKKEY = b"\x37\xfa\x21\x3d"
+PORT = 18100
+MODES = [("no cork", {}), ("cork", {"cork": True}), ("cork 1 ms", {"cork": True, "cork_delay": 0.001})]
+
+def server(port, options, ready):
+    from websocket.server import WebsocketServer
+    server = WebsocketServer(on_message=lambda sess, message: sess.send(message), **options)
+    server.listen("127.0.0.1", port)
+    ready.set()
+    time.sleep(3600)
+
+def measure(port, size):
+    sock = connect(port)
+    payload = bytearray(b"x" * size)
+    mask(payload, MASKKEY)
+    message = encode_header(c.OpcodeBinary, len(payload), maskkey=MASKKEY) + bytes(payload)
+    parser = FrameParser(unmask=False)
+    start = time.perf_counter()
+    sent = received = 0
+    while received < MESSAGES:
+        if sent - received < WINDOW // 2 and sent < MESSAGES:
+            batch = min(WINDOW - (sent - received), MESSAGES - sent)
+            sock.sendall(message * batch)
+            sent += batch
+        received += len(parser.feed(sock.recv(65536)))
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return MESSAGES / elapsed
+
+def main():
+    print("messages/s, window of %d messages" % WINDOW)
+    print("%-12s" % "size" + "".join("%12s" % name for name, _ in MODES))
+    port = PORT
+    rates = {size: [] for size in SIZES}
+    for name, options in MODES:
+        ready = multiprocessing.Event()
+        proc = multiprocessing.Process(target=server, args=(port, options, ready), daemon=True)
+        proc.start()
+        ready.wait()
+        for size in SIZES:
+            rates[size].append(measure(port, size))
+        proc.terminate()
+        proc.join()
+        port += 1
+    for size in SIZES:
+        print("%-12s" % ("%d B" % size) + "".join("%12.0f" % rate for rate in rates[size]))
+
+if __name__ == "__main__":
+    main()
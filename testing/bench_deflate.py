@@ -0,0 +1,75 @@
+# permessage-deflate on a JSON market-data feed: compression ratio, CPU per message (compress on the server
+# side + decompress on the client side) and zlib memory held per connection, for several settings.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket.deflate import PerMessageDeflate
+import json, random, time, tracemalloc, zlib
+
+MESSAGES = 2000
+CONNECTIONS = 100
+SETTINGS = [
+    ("default (15/8/6)", dict()),
+    ("fast (15/8/1)", dict(compression_level=1)),
+    ("small window (10/4/6)", dict(window_bits=10, mem_level=4)),
+    ("tiny window (9/1/6)", dict(window_bits=9, mem_level=1)),
+    ("no context takeover", dict(server_no_context_takeover=True)),
+]
+
+def feed():
+    rand = random.Random(42)
+    symbols = ["ACME", "INIT", "GLOBX", "UMBR", "WAYNE", "STARK", "TYRL", "CYBD"]
+    messages = []
+    for i in range(MESSAGES):
+        bid = round(rand.uniform(10, 500), 2)
+        messages.append(json.dumps({
+            "type": "quote", "symbol": rand.choice(symbols), "seq": i,
+            "bid": bid, "ask": round(bid + rand.uniform(0.01, 0.1), 2),
+            "bid_size": rand.randint(1, 5000), "ask_size": rand.randint(1, 5000),
+            "exchange": "XNAS", "ts": 1700000000000 + i * 17,
+        }).encode())
+    return messages
+
+def session(options):
+    offer = "permessage-deflate; client_max_window_bits"
+    _, deflate = options.negotiate(offer)
+    return deflate
+
+def ratio_and_cpu(options, messages):
+    deflate = session(options)
+    decompressor = zlib.decompressobj(-15)
+    raw = wire = 0
+    start = time.perf_counter()
+    for message in messages:
+        payload = deflate.compress(message)
+        if options.server_no_context_takeover:
+            decompressor = zlib.decompressobj(-15)
+        decompressor.decompress(payload + b"\x00\x00\xff\xff")
+        raw += len(message)
+        wire += len(payload)
+    elapsed = time.perf_counter() - start
+    return raw / wire, elapsed / len(messages)
+
+def memory(options, messages):
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    sessions = [session(options) for _ in range(CONNECTIONS)]
+    for deflate in sessions:
+        # feed the session's own output back to it, to have both of its streams allocated
+        for message in messages[:2]:
+            deflate.decompress(deflate.compress(message), True)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (current - base) / CONNECTIONS
+
+def main():
+    messages = feed()
+    print("average message: %d bytes" % (sum(map(len, messages)) // len(messages)))
+    print("%-24s %8s %14s %16s" % ("settings", "ratio", "us/message", "KiB/connection"))
+    for name, kwargs in SETTINGS:
+        options = PerMessageDeflate(threshold=0, **kwargs)
+        ratio, cpu = ratio_and_cpu(options, messages)
+        print("%-24s %8.2f %14.1f %16.1f" % (name, ratio, cpu * 1e6, memory(options, messages) / 1024))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Event-dispatch cost of the server reactor as the number of (idle) connections grows.
+# A fixed number of sessions is kept readable while all the others stay idle, and we time
+# one reactor step: poll for events, then look the session up for every ready socket.
+# The legacy step (select.select over every socket + a linear session scan) is timed too, as long as
+# the file descriptors still fit in FD_SETSIZE.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket.server import WebsocketServer, WebsocketSession
+import socket, select, selectors, resource, time
+
+ACTIVE = 10
+ROUNDS = 200
+COUNTS = [100, 1000, 10000, 50000]
+FD_SETSIZE = 1024
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = 1 << 20
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        hard = soft
+    return hard
+
+def make_server(count):
+    server = WebsocketServer()
+    server._selector = selectors.DefaultSelector()
+    peers = []
+    for _ in range(count):
+        a, b = socket.socketpair()
+        a.setblocking(0)
+        server._add_session(WebsocketSession(a, None))
+        peers.append(b)
+    # make a few sessions spread over the whole range readable
+    sessions = server.sessions
+    for i in range(ACTIVE):
+        peers[i * count // ACTIVE].send(b"x")
+    return server, sessions, peers
+
+def bench_reactor(server):
+    start = time.perf_counter()
+    dispatched = 0
+    for _ in range(ROUNDS):
+        for key, _ in server._selector.select(0):
+            sess = key.data
+            dispatched += 1
+    return (time.perf_counter() - start) / dispatched
+
+def bench_legacy(sessions):
+    socks = [sess._sock for sess in sessions]
+    start = time.perf_counter()
+    dispatched = 0
+    for _ in range(ROUNDS):
+        rlist, _, _ = select.select(socks, [], socks, 0)
+        for item in rlist:
+            sess = list(filter(lambda x: x._sock == item, sessions))[0]
+            dispatched += 1
+    return (time.perf_counter() - start) / dispatched
+
+def teardown(server, sessions, peers):
+    for sess in sessions:
+        server._remove_session(sess)
+    for peer in peers:
+        peer.close()
+    server._selector.close()
+
+def main():
+    limit = raise_fd_limit()
+    print("%10s %16s %16s" % ("sessions", "reactor us/ev", "legacy us/ev"))
+    done = set()
+    for count in COUNTS:
+        if count * 2 + 64 > limit:
+            count = (limit - 64) // 2
+            print("(capped to %d sessions by RLIMIT_NOFILE=%d)" % (count, limit))
+        if count in done:
+            continue
+        done.add(count)
+        server, sessions, peers = make_server(count)
+        reactor = bench_reactor(server)
+        if max(sess._fileno for sess in sessions) < FD_SETSIZE:
+            legacy = "%16.2f" % (bench_legacy(sessions) * 1e6)
+        else:
+            legacy = "%16s" % "n/a (>FD_SETSIZE)"
+        print("%10d %16.2f %s" % (count, reactor * 1e6, legacy))
+        teardown(server, sessions, peers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Tail latency of fast clients while other clients trigger slow handlers (50 ms each, e.g. a database call),
+# with the handlers run inline on the reactor thread, on a thread pool, and on a process pool.
+# The server runs in its own process; slow clients keep sending in the background while a fast client
+# measures echo round trips.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+from bench_async import connect
+import multiprocessing, threading, time
+
+ROUNDS = 100
+SLOW_CLIENTS = 4
+SLOW_SECONDS = 0.05
+MASKKEY = b"\x37\xfa\x21\x3d"
+PORT = 18096
+
+def handle(sess, message):
+    if message[:4] == b"slow":
+        time.sleep(SLOW_SECONDS)
+    sess.send(message)
+
+# process pool flavour: called with the client address, the return value is the reply
+def handle_remote(address, message):
+    if message[:4] == b"slow":
+        time.sleep(SLOW_SECONDS)
+    return message
+
+def server(port, mode, ready, stop):
+    import concurrent.futures
+    from websocket.server import WebsocketServer
+    executor = None
+    if mode == "inline":
+        server = WebsocketServer(on_message=handle)
+    elif mode == "thread pool":
+        executor = concurrent.futures.ThreadPoolExecutor(16)
+        server = WebsocketServer(on_message=handle, executor=executor)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(8)
+        server = WebsocketServer(on_message=handle_remote, executor=executor)
+    server.listen("127.0.0.1", port)
+    ready.set()
+    stop.wait()
+    server.close()
+    if executor is not None:
+        executor.shutdown()
+
+def frame(payload):
+    payload = bytearray(payload)
+    mask(payload, MASKKEY)
+    return encode_header(c.OpcodeBinary, len(payload), maskkey=MASKKEY) + bytes(payload)
+
+def slow_client(port, stop):
+    sock = connect(port)
+    parser = FrameParser(unmask=False)
+    message = frame(b"slow" + b"x" * 28)
+    while not stop.is_set():
+        sock.sendall(message)
+        while not parser.feed(sock.recv(4096)):
+            pass
+    sock.close()
+
+def measure(port):
+    stop = threading.Event()
+    threads = [threading.Thread(target=slow_client, args=(port, stop)) for _ in range(SLOW_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    sock = connect(port)
+    parser = FrameParser(unmask=False)
+    message = frame(b"fast" + b"x" * 28)
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        sock.sendall(message)
+        while not parser.feed(sock.recv(4096)):
+            pass
+        samples.append(time.perf_counter() - start)
+    sock.close()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    samples.sort()
+    return samples[len(samples) // 2], samples[len(samples) * 99 // 100], samples[-1]
+
+def main():
+    print("%d slow clients (%d ms handlers), fast client round trips:" % (SLOW_CLIENTS, SLOW_SECONDS * 1000))
+    print("%-12s %10s %10s %10s" % ("handlers", "p50 ms", "p99 ms", "max ms"))
+    for index, mode in enumerate(["inline", "thread pool", "process pool"]):
+        ready, stop = multiprocessing.Event(), multiprocessing.Event()
+        # not a daemon: a process pool cannot be started from a daemon process
+        proc = multiprocessing.Process(target=server, args=(PORT + index, mode, ready, stop))
+        proc.start()
+        ready.wait()
+        p50, p99, worst = measure(PORT + index)
+        stop.set()
+        proc.join()
+        print("%-12s %10.2f %10.2f %10.2f" % (mode, p50 * 1e3, p99 * 1e3, worst * 1e3))
+
+if __name__ == "__main__":
+    main()
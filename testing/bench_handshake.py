@@ -0,0 +1,80 @@
+# Handshake throughput: CPU time of handshake.process() on a buffered request, then handshakes/sec
+# against the threaded WebsocketServer over loopback, with the clients in a separate process
+# (as during a reconnect storm: connect, upgrade, close, as fast as possible).
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import socketio as io
+from websocket import handshake
+from bench_recv import HANDSHAKE
+import socket, multiprocessing, threading, time
+
+ROUNDS = 20000
+CLIENTS = 8
+SECONDS = 3
+PORT = 18092
+
+class Session:
+    def __init__(self):
+        self._state = None
+        self._reqline = None
+        self._headers = {}
+
+def measure_parse():
+    buf = io.RecvBuffer()
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        view = buf.writable()
+        view[:len(HANDSHAKE)] = HANDSHAKE
+        buf.advance(len(HANDSHAKE))
+        response, accepted = handshake.process(Session(), buf, 8192)
+        assert accepted
+    return (time.perf_counter() - start) / ROUNDS
+
+def server(port, ready):
+    from websocket.server import WebsocketServer
+    server = WebsocketServer()
+    server.listen("127.0.0.1", port, backlog=1024)
+    ready.set()
+    time.sleep(3600)
+
+def client(port, deadline, counts, index):
+    count = 0
+    while time.monotonic() < deadline:
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(HANDSHAKE)
+        response = b""
+        while b"\r\n\r\n" not in response:
+            response += sock.recv(4096)
+        assert response.startswith(b"HTTP/1.1 101"), response
+        sock.close()
+        count += 1
+    counts[index] = count
+
+def clients(port, result):
+    deadline = time.monotonic() + SECONDS
+    counts = [0] * CLIENTS
+    threads = [threading.Thread(target=client, args=(port, deadline, counts, i)) for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.put(sum(counts))
+
+def main():
+    print("handshake.process       %10.2f us/handshake" % (measure_parse() * 1e6))
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=server, args=(PORT, ready), daemon=True)
+    proc.start()
+    ready.wait()
+    result = multiprocessing.Queue()
+    loadgen = multiprocessing.Process(target=clients, args=(PORT, result))
+    loadgen.start()
+    total = result.get()
+    loadgen.join()
+    proc.terminate()
+    proc.join()
+    print("loopback, %d clients    %10.0f handshakes/sec" % (CLIENTS, total / SECONDS))
+
+if __name__ == "__main__":
+    main()
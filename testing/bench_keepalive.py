@@ -0,0 +1,87 @@
+# Reactor CPU with many idle connections under keepalive: the threaded server runs in its own process
+# with 30s ping intervals, a client process holds the connections open and answers every ping, and we
+# sample the server's CPU time over one full interval (so every session is pinged once).
+# The connection count is capped by the file descriptor limit.
+#
+#     python bench_keepalive.py [connections] [seconds]
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from bench_dispatch import raise_fd_limit
+from bench_recv import HANDSHAKE
+import socket, selectors, multiprocessing, time
+
+CONNECTIONS = 50000
+INTERVAL = 30.0
+PORT = 18093
+MASKKEY = b"\x37\xfa\x21\x3d"
+
+def server(port, conn):
+    from websocket.server import WebsocketServer
+    raise_fd_limit()
+    server = WebsocketServer(ping_interval=INTERVAL, ping_timeout=10.0)
+    server.listen("127.0.0.1", port, backlog=4096)
+    conn.send(None)
+    while True:
+        command = conn.recv()
+        if command == "cpu":
+            conn.send((time.process_time(), len(server.sessions)))
+        elif command == "close":
+            server.close()
+            return
+
+def client(port, count, seconds, conn):
+    raise_fd_limit()
+    selector = selectors.DefaultSelector()
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(HANDSHAKE)
+        response = b""
+        while b"\r\n\r\n" not in response:
+            response += sock.recv(4096)
+        sock.setblocking(0)
+        selector.register(sock, selectors.EVENT_READ, FrameParser(unmask=False))
+    conn.send(None)
+    pong = encode_header(c.OpcodePong, 0, maskkey=MASKKEY)
+    pings = 0
+    deadline = time.monotonic() + seconds + 1
+    while time.monotonic() < deadline:
+        for key, _ in selector.select(0.5):
+            for frame in key.data.feed(key.fileobj.recv(4096)):
+                if frame.opcode == c.OpcodePing:
+                    key.fileobj.send(pong)
+                    pings += 1
+    conn.send(pings)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else CONNECTIONS
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else INTERVAL
+    # both processes hold one descriptor per connection
+    count = min(count, raise_fd_limit() - 100)
+    server_conn, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=server, args=(PORT, child), daemon=True)
+    proc.start()
+    server_conn.recv()
+    client_conn, child = multiprocessing.Pipe()
+    loadgen = multiprocessing.Process(target=client, args=(PORT, count, seconds, child), daemon=True)
+    start = time.monotonic()
+    loadgen.start()
+    client_conn.recv()
+    print("%d connections established in %.1fs" % (count, time.monotonic() - start))
+    server_conn.send("cpu")
+    cpu_start, _ = server_conn.recv()
+    time.sleep(seconds)
+    server_conn.send("cpu")
+    cpu_end, sessions = server_conn.recv()
+    pings = client_conn.recv()
+    loadgen.join()
+    server_conn.send("close")
+    proc.join()
+    print("interval %.0fs, window %.0fs: %d pings answered, %d sessions alive" % (INTERVAL, seconds, pings, sessions))
+    print("server CPU: %.2f%% of a core, %.1f us per session per interval"
+          % ((cpu_end - cpu_start) / seconds * 100, (cpu_end - cpu_start) / count * 1e6 * INTERVAL / seconds))
+
+if __name__ == "__main__":
+    main()
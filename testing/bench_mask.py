@@ -0,0 +1,50 @@
+# Unmasking throughput for payloads from 16 B to 16 MB.
+# Compares the per-byte Python loop with websocket.mask.unmask (integer blocks, and NumPy if installed).
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import mask
+import time
+
+SIZES = [16, 256, 4 << 10, 64 << 10, 1 << 20, 16 << 20]
+NAIVE_LIMIT = 1 << 20 # the per-byte loop is too slow to bother beyond this
+MASKKEY = b"\x37\xfa\x21\x3d"
+
+def naive(buffer, maskkey, offset=0):
+    for i in range(len(buffer)):
+        buffer[i] ^= maskkey[(offset + i) % 4]
+
+def int_backend(buffer, maskkey, offset=0):
+    numpy, mask.numpy = mask.numpy, None
+    try:
+        mask.unmask(buffer, maskkey, offset)
+    finally:
+        mask.numpy = numpy
+
+def throughput(fn, size):
+    buffer = bytearray(os.urandom(size))
+    repeat = max(1, (32 << 20) // size)
+    if fn is naive:
+        repeat = max(1, repeat // 256)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(buffer, MASKKEY)
+    elapsed = time.perf_counter() - start
+    return size * repeat / elapsed / (1 << 20)
+
+def main():
+    backends = [("per-byte loop", naive), ("int blocks", int_backend)]
+    if mask.numpy is not None:
+        backends.append(("numpy", mask.unmask))
+    print("%10s" % "size" + "".join("%16s" % name for name, _ in backends) + "   (MB/s)")
+    for size in SIZES:
+        row = "%10d" % size
+        for name, fn in backends:
+            if fn is naive and size > NAIVE_LIMIT:
+                row += "%16s" % "-"
+            else:
+                row += "%16.1f" % throughput(fn, size)
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Memory per session of the threaded server: 10k sessions that completed their handshake and sit idle,
+# then the same sessions each in the middle of receiving a 4 KiB message. Sessions are driven by hand
+# over socketpairs (no reactor thread); Python heap is measured with tracemalloc, process memory as RSS.
+# The session count is capped by the file descriptor limit (two descriptors per session).
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.server import WebsocketServer, WebsocketSession
+from websocket.frame import encode_header
+from bench_dispatch import raise_fd_limit
+from bench_recv import HANDSHAKE
+import socket, selectors, threading, tracemalloc
+
+SESSIONS = 10000
+MASKKEY = b"\x37\xfa\x21\x3d"
+MESSAGE = 4096
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+# Heap and RSS bytes per session with `count` idle sessions, then with each of them receiving a message.
+def measure(count):
+    server = WebsocketServer()
+    server._selector = selectors.DefaultSelector()
+    server._thread_ident = threading.get_ident()
+    tracemalloc.start()
+    peers = []
+    traced_start, rss_start = tracemalloc.get_traced_memory()[0], rss()
+    for _ in range(count):
+        a, b = socket.socketpair()
+        a.setblocking(0)
+        sess = WebsocketSession(a, None, server._pool)
+        server._add_session(sess)
+        b.sendall(HANDSHAKE)
+        server._handle_read(sess)
+        assert sess.state == c.StateConnected
+        b.recv(4096)
+        peers.append(b)
+    traced_idle, rss_idle = tracemalloc.get_traced_memory()[0], rss()
+    # half of a masked binary frame: the payload buffer is allocated, the rest is still on its way
+    frame = encode_header(c.OpcodeBinary, MESSAGE, maskkey=MASKKEY) + b"x" * (MESSAGE // 2)
+    for sess, peer in zip(server.sessions, peers):
+        peer.sendall(frame)
+        server._handle_read(sess)
+    traced_active, rss_active = tracemalloc.get_traced_memory()[0], rss()
+    tracemalloc.stop()
+    return {"idle_heap": (traced_idle - traced_start) / count, "idle_rss": (rss_idle - rss_start) / count,
+            "active_heap": (traced_active - traced_start) / count, "active_rss": (rss_active - rss_start) / count,
+            "pool": server._pool.stats()}
+
+def main():
+    count = min(SESSIONS, (raise_fd_limit() - 100) // 2)
+    result = measure(count)
+    print("%d sessions" % count)
+    print("%-28s %14s %14s" % ("", "heap B/session", "RSS B/session"))
+    print("%-28s %14.0f %14.0f" % ("idle", result["idle_heap"], result["idle_rss"]))
+    print("%-28s %14.0f %14.0f" % ("active (4 KiB in flight)", result["active_heap"], result["active_rss"]))
+    print("free buffers in the pool: %d (%d bytes)" % result["pool"])
+
+if __name__ == "__main__":
+    main()
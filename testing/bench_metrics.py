@@ -0,0 +1,66 @@
+# Cost of the metrics: echo throughput of the threaded server over loopback without metrics, with server
+# metrics, and with per-session metrics and a tracing hook. Each server runs in its own process; the client
+# keeps a window of small masked messages in flight and counts the echoes.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+from bench_async import connect
+import multiprocessing, time
+
+MESSAGES = 50000
+WINDOW = 1024
+PAYLOAD = b"x" * 32
+MASKKEY = b"\x37\xfa\x21\x3d"
+PORT = 18094
+
+def server(port, mode, ready):
+    from websocket.server import WebsocketServer
+    from websocket.metrics import Metrics
+    metrics = None
+    if mode == "server":
+        metrics = Metrics()
+    elif mode == "per-session + trace":
+        metrics = Metrics(per_session=True, trace=lambda event, sess, *info: None)
+    server = WebsocketServer(on_message=lambda sess, message: sess.send(message), metrics=metrics)
+    server.listen("127.0.0.1", port)
+    ready.set()
+    time.sleep(3600)
+
+def measure(port):
+    sock = connect(port)
+    payload = bytearray(PAYLOAD)
+    mask(payload, MASKKEY)
+    message = encode_header(c.OpcodeBinary, len(payload), maskkey=MASKKEY) + bytes(payload)
+    parser = FrameParser(unmask=False)
+    start = time.perf_counter()
+    sent = received = 0
+    while received < MESSAGES:
+        if sent - received < WINDOW // 2 and sent < MESSAGES:
+            batch = min(WINDOW - (sent - received), MESSAGES - sent)
+            sock.sendall(message * batch)
+            sent += batch
+        received += len(parser.feed(sock.recv(65536)))
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return MESSAGES / elapsed
+
+def main():
+    print("%-22s %12s %10s" % ("metrics", "messages/s", "overhead"))
+    baseline = None
+    for index, mode in enumerate(["off", "server", "per-session + trace"]):
+        ready = multiprocessing.Event()
+        proc = multiprocessing.Process(target=server, args=(PORT + index, mode, ready), daemon=True)
+        proc.start()
+        ready.wait()
+        rate = measure(PORT + index)
+        proc.terminate()
+        proc.join()
+        if baseline is None:
+            baseline = rate
+        print("%-22s %12.0f %9.1f%%" % (mode, rate, (baseline / rate - 1) * 100))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# Parse throughput of FrameParser for small masked client messages.
+# Frames are fed in 64 KiB chunks (as the server does after a large recv_into), one frame per feed,
+# and in 1400-byte (one TCP segment) chunks that split frames across feeds.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket.frame import FrameParser
+from websocket.mask import mask
+import struct, time
+
+SIZES = [16, 64, 256]
+COUNT = 100000
+MASKKEY = b"\x37\xfa\x21\x3d"
+
+def client_frame(payload):
+    payload = bytearray(payload)
+    mask(payload, MASKKEY)
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, 0x80 | len(payload))
+    else:
+        header = struct.pack("!BBH", 0x81, 0x80 | 126, len(payload))
+    return header + MASKKEY + bytes(payload)
+
+def bench(frame, chunk_size):
+    stream = bytearray(frame * COUNT)
+    if chunk_size is None:
+        chunk_size = len(frame)
+    chunks = [memoryview(stream)[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+    parser = FrameParser()
+    parsed = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        parsed += len(parser.feed(chunk))
+    elapsed = time.perf_counter() - start
+    assert parsed == COUNT
+    return COUNT / elapsed
+
+def main():
+    print("%10s %18s %18s %18s" % ("payload", "64K chunks", "frame per feed", "1400B chunks"))
+    for size in SIZES:
+        frame = client_frame(b"x" * size)
+        print("%10d %18.0f %18.0f %18.0f   frames/s" % (size, bench(frame, 1 << 16), bench(frame, None), bench(frame, 1400)))
+
+if __name__ == "__main__":
+    main()
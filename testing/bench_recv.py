@@ -0,0 +1,134 @@
+# Syscalls and time per handshake and per frame, byte-at-a-time receiving vs. the buffered RecvBuffer.
+# The byte-at-a-time reader below reproduces the former socketio.recv_line / recv_bytes:
+# one `sock.recv(1)` for every byte of a header line or a frame header field.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import socketio as io
+import socket, time
+
+HANDSHAKE = (
+    b"GET /chat HTTP/1.1\r\n"
+    b"Host: localhost:8080\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n"
+    b"Accept: */*\r\n"
+    b"Accept-Language: en-US,en;q=0.5\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Sec-WebSocket-Version: 13\r\n"
+    b"Origin: http://localhost:8080\r\n"
+    b"Sec-WebSocket-Extensions: permessage-deflate\r\n"
+    b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+    b"Connection: keep-alive, Upgrade\r\n"
+    b"Pragma: no-cache\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Upgrade: websocket\r\n"
+    b"\r\n"
+)
+# a masked 32-byte text frame
+FRAME = b"\x81\xa0" + b"\x01\x02\x03\x04" + b"x" * 32
+FRAMES = 1000
+
+class CountingSocket:
+    def __init__(self, sock):
+        self._sock = sock
+        self.syscalls = 0
+    def recv(self, n):
+        self.syscalls += 1
+        return self._sock.recv(n)
+    def recv_into(self, view, n=0):
+        self.syscalls += 1
+        return self._sock.recv_into(view, n)
+
+def bytewise_recv_line(sock, maxlen):
+    buffer = bytearray(maxlen)
+    for i in range(maxlen):
+        thebyte = sock.recv(1)
+        if len(thebyte) == 0:
+            return None
+        buffer[i] = thebyte[0]
+        if buffer[i-1:i+1] == b"\r\n":
+            return bytes(buffer[:i+1])
+    return None
+
+def bytewise_recv_bytes(sock, length):
+    buffer = bytearray(length)
+    for i in range(length):
+        thebyte = sock.recv(1)
+        if len(thebyte) == 0:
+            return None
+        buffer[i] = thebyte[0]
+    return bytes(buffer)
+
+def bytewise_handshake(sock):
+    while bytewise_recv_line(sock, 1024) != b"\r\n":
+        pass
+
+def bytewise_frame(sock):
+    header = bytewise_recv_bytes(sock, 2)
+    maskkey = bytewise_recv_bytes(sock, 4)
+    payload = bytearray(header[1] & 0x7f)
+    sock.recv_into(payload, len(payload))
+
+def buffered_handshake(sock, buf):
+    while True:
+        line, error = buf.read_line(1024)
+        if error == io.e.ErrorStreamEmpty:
+            buf.fill(sock)
+        elif line == b"\r\n":
+            return
+
+def buffered_frame(sock, buf):
+    while len(buf) < 6:
+        buf.fill(sock)
+    header, _ = buf.read_bytes(2)
+    maskkey, _ = buf.read_bytes(4)
+    payload = memoryview(bytearray(header[1] & 0x7f))
+    got = 0
+    while got < len(payload):
+        if len(buf) == 0:
+            buf.fill(sock)
+        n, _ = buf.read_into(payload[got:])
+        got += n
+
+# Read `repeat` items sent back to back on one connection.
+def run(name, data, repeat, reader):
+    a, b = socket.socketpair()
+    b.sendall(data * repeat)
+    sock = CountingSocket(a)
+    start = time.perf_counter()
+    reader(sock, repeat)
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    print("%-28s %14.1f %14.2f" % (name, sock.syscalls / repeat, elapsed / repeat * 1e6))
+
+# Read one item on each of `repeat` connections, as a server sees handshakes: a buffer cannot batch them.
+def run_each(name, data, repeat, reader):
+    syscalls = 0
+    elapsed = 0.0
+    for _ in range(repeat):
+        a, b = socket.socketpair()
+        b.sendall(data)
+        sock = CountingSocket(a)
+        start = time.perf_counter()
+        reader(sock)
+        elapsed += time.perf_counter() - start
+        syscalls += sock.syscalls
+        a.close()
+        b.close()
+    print("%-28s %14.1f %14.2f" % (name, syscalls / repeat, elapsed / repeat * 1e6))
+
+def main():
+    print("%-28s %14s %14s" % ("", "syscalls/item", "us/item"))
+    def bytewise_frames(sock, n):
+        for _ in range(n): bytewise_frame(sock)
+    def buffered_frames(sock, n):
+        buf = io.RecvBuffer()
+        for _ in range(n): buffered_frame(sock, buf)
+    run_each("handshake, byte-at-a-time", HANDSHAKE, 20, bytewise_handshake)
+    run_each("handshake, buffered", HANDSHAKE, 20, lambda sock: buffered_handshake(sock, io.RecvBuffer()))
+    run("frame, byte-at-a-time", FRAME, FRAMES, bytewise_frames)
+    run("frame, buffered", FRAME, FRAMES, buffered_frames)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# Benchmark suite: the hot paths and end-to-end loopback numbers in one run, saved as JSON so that two
+# runs (e.g. two releases) can be compared.
+#
+#     python testing/bench_suite.py run -o before.json
+#     python testing/bench_suite.py run -o after.json
+#     python testing/bench_suite.py compare before.json after.json
+#
+# Every benchmark runs `--repeat` times, each time in a fresh process (servers get processes of their own),
+# and the median of the runs is what gets compared. `compare` flags a metric as a regression when it got
+# worse by more than `--threshold` percent and the ranges of the runs do not overlap, and exits with status 1
+# if any did. `-k` picks the benchmarks whose name contains one of the given strings.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import socketio as io
+import argparse, json, multiprocessing, platform, queue, socket, statistics, time
+
+import bench_async, bench_broadcast, bench_handshake, bench_mask, bench_memory, bench_parser
+from bench_dispatch import raise_fd_limit
+from bench_recv import HANDSHAKE, FRAME
+
+ROUNDS = 20000
+ECHO_CONNECTIONS = [1, 100, 10000]
+ECHO_SECONDS = 2.0
+FANOUT_SESSIONS = 10000
+MEMORY_SESSIONS = 10000
+
+# metric name -> (unit, whether higher is better)
+UNITS = {}
+
+def metric(name, unit, higher_is_better=True):
+    UNITS[name] = (unit, higher_is_better)
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def start_server(target):
+    port = free_port()
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=target, args=(port, ready), daemon=True)
+    proc.start()
+    ready.wait()
+    return port, proc
+
+# benchmarks: each returns a dict of metric values
+
+def socketio_reads():
+    lines = HANDSHAKE.count(b"\r\n")
+    buf = io.RecvBuffer()
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        view = buf.writable()
+        view[:len(HANDSHAKE)] = HANDSHAKE
+        buf.advance(len(HANDSHAKE))
+        while buf.read_line(1024)[0] is not None:
+            pass
+    line_rate = ROUNDS * lines / (time.perf_counter() - start)
+    frames = FRAME * 100
+    buf = io.RecvBuffer()
+    start = time.perf_counter()
+    for _ in range(ROUNDS // 10):
+        view = buf.writable()
+        view[:len(frames)] = frames
+        buf.advance(len(frames))
+        for _ in range(100):
+            buf.read_bytes(2)
+            buf.read_bytes(4)
+            buf.read_bytes(32)
+        buf.read_all() # rewinds the emptied buffer
+    bytes_rate = ROUNDS // 10 * 300 / (time.perf_counter() - start)
+    return {"socketio.read_line": line_rate, "socketio.read_bytes": bytes_rate}
+
+metric("socketio.read_line", "lines/s")
+metric("socketio.read_bytes", "reads/s")
+
+def frame_parsing():
+    frame = bench_parser.client_frame(b"x" * 64)
+    return {"parser.frames_64k_chunks": bench_parser.bench(frame, 1 << 16),
+            "parser.frames_1400b_chunks": bench_parser.bench(frame, 1400),
+            "parser.unmask_4k": bench_mask.throughput(bench_mask.mask.unmask, 4 << 10),
+            "parser.unmask_1m": bench_mask.throughput(bench_mask.mask.unmask, 1 << 20)}
+
+metric("parser.frames_64k_chunks", "frames/s")
+metric("parser.frames_1400b_chunks", "frames/s")
+metric("parser.unmask_4k", "MB/s")
+metric("parser.unmask_1m", "MB/s")
+
+def handshakes():
+    port, proc = start_server(bench_handshake.server)
+    result = multiprocessing.Queue()
+    clients = multiprocessing.Process(target=bench_handshake.clients, args=(port, result))
+    clients.start()
+    total = result.get()
+    clients.join()
+    proc.terminate()
+    proc.join()
+    return {"handshake.process": 1 / bench_handshake.measure_parse(),
+            "handshake.loopback": total / bench_handshake.SECONDS}
+
+metric("handshake.process", "handshakes/s")
+metric("handshake.loopback", "handshakes/s")
+
+def echo():
+    from websocket import aio, loadgen
+    limit = raise_fd_limit()
+    port, proc = start_server(bench_async.threaded_server)
+    values = {}
+    for level in ECHO_CONNECTIONS:
+        # the server's descriptors count against the same limit when both run on this machine
+        count = min(level, (limit - 200) // 2)
+        if count < level:
+            print("echo: %d connections instead of %d (file descriptor limit)" % (count, level), flush=True)
+        result = aio.run(loadgen.generate("127.0.0.1", port, connections=count, duration=ECHO_SECONDS, warmup=0.5))
+        name = echo_name(level)
+        samples = result["latencies"]
+        values[name + ".p50"] = loadgen.percentile(samples, 0.5) * 1e3
+        values[name + ".p99"] = loadgen.percentile(samples, 0.99) * 1e3
+        values[name + ".rate"] = result["messages"] / result["elapsed"]
+    proc.terminate()
+    proc.join()
+    return values
+
+def echo_name(level):
+    return "echo.%s" % (level if level < 1000 else "%dk" % (level // 1000))
+
+for level in ECHO_CONNECTIONS:
+    name = echo_name(level)
+    metric(name + ".p50", "ms", False)
+    metric(name + ".p99", "ms", False)
+    metric(name + ".rate", "messages/s")
+
+def fanout():
+    from websocket.server import WebsocketServer
+    count = min(FANOUT_SESSIONS, raise_fd_limit() // 2 - 100)
+    port = free_port()
+    server = WebsocketServer()
+    server.listen("127.0.0.1", port, backlog=1024)
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    clients = multiprocessing.Process(target=bench_broadcast.clients, args=(port, count, ready, stop))
+    clients.start()
+    ready.wait()
+    while len(server.sessions) < count:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    for _ in range(bench_broadcast.MESSAGES):
+        bench_broadcast.fanout(server)
+    bench_broadcast.wait_flushed(server)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    clients.join()
+    server.close()
+    return {"broadcast.deliveries": count * bench_broadcast.MESSAGES / elapsed}
+
+metric("broadcast.deliveries", "deliveries/s")
+
+def memory():
+    result = bench_memory.measure(min(MEMORY_SESSIONS, (raise_fd_limit() - 100) // 2))
+    return {"memory.idle_heap": result["idle_heap"], "memory.idle_rss": result["idle_rss"],
+            "memory.active_heap": result["active_heap"]}
+
+metric("memory.idle_heap", "B/connection", False)
+metric("memory.idle_rss", "B/connection", False)
+metric("memory.active_heap", "B/connection", False)
+
+BENCHMARKS = [("socketio", socketio_reads), ("parser", frame_parsing), ("handshake", handshakes), ("echo", echo),
+              ("broadcast", fanout), ("memory", memory)]
+
+# running
+
+def worker(fn, results):
+    results.put(fn())
+
+# Run a benchmark in a fresh process, returns its values or None if it failed.
+def run_isolated(fn):
+    results = multiprocessing.Queue()
+    # not a daemon: benchmarks start server and client processes
+    proc = multiprocessing.Process(target=worker, args=(fn, results))
+    proc.start()
+    while True:
+        try:
+            values = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not proc.is_alive():
+                return None
+    proc.join()
+    return values
+
+def metadata():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": numpy.__version__ if numpy is not None else None,
+            "uvloop": uvloop.__version__ if uvloop is not None else None,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+def run(args):
+    results = {}
+    for name, fn in BENCHMARKS:
+        if args.k and not any(pattern in name for pattern in args.k):
+            continue
+        runs = []
+        for _ in range(args.repeat):
+            values = run_isolated(fn)
+            if values is None:
+                print("%s failed, see the traceback above" % name, flush=True)
+                break
+            runs.append(values)
+        if len(runs) < args.repeat:
+            continue
+        for key in runs[0]:
+            unit, higher = UNITS[key]
+            values = [values_of_run[key] for values_of_run in runs]
+            results[key] = {"unit": unit, "higher_is_better": higher, "values": values,
+                            "median": statistics.median(values)}
+            print("%-28s %16.2f %-14s (%s)" % (key, results[key]["median"], unit,
+                                               ", ".join("%.2f" % value for value in values)), flush=True)
+    report = {"metadata": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    print("%-28s %14s %14s %9s" % ("metric", "baseline", "current", "change"))
+    regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key], current[key]
+        change = (new["median"] / old["median"] - 1) * 100 if old["median"] else 0.0
+        # positive when better
+        gain = change if old["higher_is_better"] else -change
+        overlap = min(old["values"]) <= max(new["values"]) and min(new["values"]) <= max(old["values"])
+        flag = ""
+        if abs(change) > args.threshold and not overlap:
+            if gain < 0:
+                flag = "REGRESSION"
+                regressions += 1
+            else:
+                flag = "improved"
+        print("%-28s %14.2f %14.2f %+8.1f%% %s" % (key, old["median"], new["median"], change, flag))
+    for key in sorted(set(baseline) ^ set(current)):
+        print("%-28s only in %s" % (key, args.baseline if key in baseline else args.current))
+    print("%d regression(s) beyond %.1f%%" % (regressions, args.threshold))
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Websocket benchmark suite.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("-o", "--output", help="file to write the results to (default: standard output)")
+    run_parser.add_argument("-r", "--repeat", type=int, default=3, help="runs of every benchmark (default 3)")
+    run_parser.add_argument("-k", action="append", help="only run the benchmarks whose name contains this")
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("-t", "--threshold", type=float, default=5.0,
+                                help="change in percent beyond which a metric is flagged (default 5)")
+    commands.add_parser("list", help="list the benchmarks and their metrics")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        sys.exit(compare(args))
+    else:
+        for key, (unit, higher) in UNITS.items():
+            print("%-28s %s, %s is better" % (key, unit, "higher" if higher else "lower"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Handshakes/sec and echo messages/sec of a WorkerPool as the number of workers grows.
+# Load comes from several client processes over loopback; run it on a multi-core Linux box,
+# as with a single core the workers only compete with each other and the clients.
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+from websocket.server import WebsocketServer
+from websocket.workers import WorkerPool
+from bench_async import connect
+import multiprocessing, time
+
+PORT = 18092
+DURATION = 2.0
+CLIENTS = max(2, os.cpu_count() or 1)
+MASKKEY = b"\x37\xfa\x21\x3d"
+
+def echo(sess, message):
+    sess.send(message)
+
+def echo_server():
+    return WebsocketServer(on_message=echo)
+
+def handshake_client(results):
+    count = 0
+    deadline = time.monotonic() + DURATION
+    while time.monotonic() < deadline:
+        connect(PORT).close()
+        count += 1
+    results.put(count)
+
+def message_client(results):
+    sock = connect(PORT)
+    payload = bytearray(b"x" * 32)
+    mask(payload, MASKKEY)
+    message = encode_header(c.OpcodeBinary, len(payload), maskkey=MASKKEY) + bytes(payload)
+    parser = FrameParser(unmask=False)
+    count = 0
+    deadline = time.monotonic() + DURATION
+    while time.monotonic() < deadline:
+        sock.sendall(message)
+        while not parser.feed(sock.recv(4096)):
+            pass
+        count += 1
+    sock.close()
+    results.put(count)
+
+def run_clients(target):
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=target, args=(results,)) for _ in range(CLIENTS)]
+    for client in clients:
+        client.start()
+    total = sum(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+    return total / DURATION
+
+def main():
+    counts = sorted(set([1, 2, 4, os.cpu_count() or 1]))
+    print("%8s %16s %16s" % ("workers", "handshakes/s", "messages/s"))
+    for workers in counts:
+        pool = WorkerPool(workers=workers, server_factory=echo_server, backlog=1024)
+        pool.start("127.0.0.1", PORT)
+        handshakes = run_clients(handshake_client)
+        messages = run_clients(message_client)
+        pool.close()
+        print("%8d %16.0f %16.0f" % (workers, handshakes, messages))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Regression tests for FrameParser and MessageAssembler fed the way the server feeds them: every chunk is
+# received into the same (possibly pooled) receive buffer, which is reused once the chunk has been parsed.
+#
+#     python -m unittest discover -s testing -p "test_*.py"
+import sys, os
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from websocket import constants as c
+from websocket import socketio as io
+from websocket.frame import FrameParser, encode_header
+from websocket.mask import mask
+from websocket.message import MessageAssembler
+from websocket.pool import BufferPool
+import unittest
+
+MASKKEY = b"\x37\xfa\x21\x3d"
+
+def client_frame(opcode, payload, fin=True):
+    payload = bytearray(payload)
+    mask(payload, MASKKEY)
+    return encode_header(opcode, len(payload), fin=fin, maskkey=MASKKEY) + bytes(payload)
+
+class ChunkBoundaryTest(unittest.TestCase):
+    def receive(self, chunks, pool=None, streaming=False):
+        recvbuf = io.RecvBuffer(pool=pool)
+        parser = FrameParser(streaming=streaming, pool=pool)
+        assembler = MessageAssembler(streaming=streaming)
+        messages = []
+        pieces = [] # of the message being streamed
+        for chunk in chunks:
+            view = recvbuf.writable()
+            view[:len(chunk)] = chunk
+            recvbuf.advance(len(chunk))
+            data, _ = recvbuf.read_all()
+            for frame in parser.feed(data):
+                message = assembler.feed(frame)
+                if message is not None:
+                    opcode, data, final = message
+                    if isinstance(data, str):
+                        data = data.encode("utf-8")
+                    pieces.append(bytes(data))
+                    if final:
+                        data = b"".join(pieces)
+                        pieces = []
+                        messages.append((opcode, data, len(data)))
+            recvbuf.release()
+            # the next chunk overwrites the receive buffer
+            if recvbuf._buffer is not None:
+                recvbuf._buffer[:] = b"\xff" * len(recvbuf._buffer)
+        return messages
+
+    def check_pool(self, pool, count):
+        free = [buffer for buffers in pool._free for buffer in buffers]
+        self.assertEqual(len(free), len(set(map(id, free))), "a buffer was given back to the pool twice")
+        self.assertEqual(pool.stats()[0], count)
+
+    def test_header_then_payload(self):
+        for pool in (None, BufferPool()):
+            frame = client_frame(c.OpcodeBinary, b"hello")
+            messages = self.receive([frame[:6], frame[6:]], pool)
+            self.assertEqual(messages, [(c.OpcodeBinary, b"hello", 5)])
+            if pool is not None:
+                # only the receive buffer, the payload was never buffered
+                self.check_pool(pool, 1)
+
+    def test_header_then_split_payload(self):
+        for pool in (None, BufferPool()):
+            frame = client_frame(c.OpcodeBinary, b"hello world")
+            messages = self.receive([frame[:6], frame[6:9], frame[9:]], pool)
+            self.assertEqual(messages, [(c.OpcodeBinary, b"hello world", 11)])
+            if pool is not None:
+                # the receive buffer and the payload buffer, both given back once
+                self.check_pool(pool, 2)
+
+    def test_fragments(self):
+        for pool in (None, BufferPool()):
+            first = client_frame(c.OpcodeText, b"hello ", fin=False)
+            second = client_frame(c.OpcodeContinuation, b"big ", fin=False)
+            last = client_frame(c.OpcodeContinuation, b"world")
+            chunks = [first[:6], first[6:], second[:6], second[6:8], second[8:] + last[:6], last[6:]]
+            messages = self.receive(chunks, pool)
+            self.assertEqual(messages, [(c.OpcodeText, b"hello big world", 15)])
+            if pool is not None:
+                self.check_pool(pool, 2)
+
+    def test_streaming(self):
+        payload = bytes(range(256)) * 40
+        frame = client_frame(c.OpcodeBinary, payload)
+        chunks = [frame[i:i + 1001] for i in range(0, len(frame), 1001)]
+        messages = self.receive(chunks, streaming=True)
+        self.assertEqual(messages, [(c.OpcodeBinary, payload, len(payload))])
+
+    def test_streaming_fragments(self):
+        first = client_frame(c.OpcodeText, b"x" * 3000, fin=False)
+        last = client_frame(c.OpcodeContinuation, b"y" * 7000)
+        stream = first + last
+        # the first chunk ends right after the first header
+        chunks = [stream[:8]] + [stream[i:i + 1001] for i in range(8, len(stream), 1001)]
+        messages = self.receive(chunks, streaming=True)
+        self.assertEqual(messages, [(c.OpcodeText, b"x" * 3000 + b"y" * 7000, 10000)])
+
+if __name__ == "__main__":
+    unittest.main()
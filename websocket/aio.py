@@ -0,0 +1,274 @@
+import asyncio, collections
+
+from . import constants as c
+from . import socketio as io
+from . import handshake
+from .frame import FrameParser, ProtocolError, encode_header
+from .message import MessageAssembler
+from .pool import BufferPool
+
+# asyncio flavour of the server, for applications that already run an event loop.
+# Sessions are asyncio.BufferedProtocol objects: the transport receives straight into the session's
+# RecvBuffer, the handshake and the frame parsing are the same code the threaded server runs.
+#
+#     async def echo(session):
+#         async for message in session:
+#             await session.send(message)
+#
+#     server = AsyncWebsocketServer(echo)
+#     await server.listen("0.0.0.0", 8080)
+
+# Base of the asyncio endpoints, the server's sessions and the client's connections (client.py): the receive
+# buffer the transport reads into, write flow control, and the queue of received messages recv() takes from.
+# Reading is paused while `max_queue` messages are queued, and resumed once half of them have been taken.
+class AsyncWebsocketProtocol(asyncio.BufferedProtocol):
+    def __init__(self, state, pool, max_queue):
+        self._transport = None
+        self._recvbuf = io.RecvBuffer(pool=pool)
+        self._parser = None # set up once the handshake is done
+        self._assembler = None
+        self._state = state
+        self._max_queue = max_queue
+        self._messages = collections.deque()
+        self._message_waiter = None
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiter = None
+
+    @property
+    def state(self):
+        return self._state
+
+    # asyncio protocol callbacks
+
+    def get_buffer(self, sizehint):
+        view = self._recvbuf.writable()
+        if view is None:
+            # nothing consumed the buffered data, so the peer is misbehaving
+            self._transport.abort()
+            return memoryview(bytearray(1))
+        return view
+
+    def connection_lost(self, exc):
+        self._state = c.StateClosed
+        self._wakeup(self._message_waiter)
+        self._wakeup(self._drain_waiter)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._wakeup(self._drain_waiter)
+
+    def _queue_message(self, data):
+        self._messages.append(data)
+        if len(self._messages) >= self._max_queue and not self._reading_paused:
+            self._reading_paused = True
+            self._transport.pause_reading()
+        self._wakeup(self._message_waiter)
+
+    @staticmethod
+    def _wakeup(waiter):
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    # application interface
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.recv()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    # Wait for the next message (str for text, bytes-like for binary), returns None once the connection is closing.
+    async def recv(self):
+        while not self._messages:
+            if self._state != c.StateConnected:
+                return None
+            self._message_waiter = asyncio.get_running_loop().create_future()
+            await self._message_waiter
+            self._message_waiter = None
+        message = self._messages.popleft()
+        if self._reading_paused and len(self._messages) <= self._max_queue // 2:
+            self._reading_paused = False
+            self._transport.resume_reading()
+        return message
+
+    # Wait while the transport's write buffer is above its high-water mark.
+    async def drain(self):
+        while self._writing_paused and self._state != c.StateClosed:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+            await self._drain_waiter
+            self._drain_waiter = None
+
+class AsyncWebsocketSession(AsyncWebsocketProtocol):
+    def __init__(self, server):
+        super().__init__(c.StateUnconnected, server._pool, server._max_queue)
+        self._server = server
+        self._address = None
+        self._deflate = None
+        self._reqline = None
+        self._headers = {}
+        self._task = None
+        self._handshake_timer = None
+
+    # asyncio protocol callbacks
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._address = transport.get_extra_info("peername")
+        transport.set_write_buffer_limits(self._server._write_high, self._server._write_low)
+        if self._server._handshake_timeout is not None:
+            self._handshake_timer = asyncio.get_running_loop().call_later(self._server._handshake_timeout, transport.abort)
+        self._server._sessions.add(self)
+
+    def buffer_updated(self, nbytes):
+        self._recvbuf.advance(nbytes)
+        if self._state == c.StateUnconnected:
+            response, accepted = handshake.process(self, self._recvbuf, self._server._buffer_size, self._server._deflate)
+            if response is None:
+                return
+            self._transport.write(response)
+            if self._handshake_timer is not None:
+                self._handshake_timer.cancel()
+            if not accepted:
+                self._transport.close()
+                return
+            self._parser = FrameParser(max_frame_size=self._server._max_frame_size, pool=self._server._pool)
+            self._assembler = MessageAssembler(self._server._max_message_size, deflate=self._deflate)
+            self._task = asyncio.get_running_loop().create_task(self._run_handler())
+        # Payloads of the parsed frames may point into the receive buffer, so they are copied
+        # (or answered) right here, before the transport fills the buffer again.
+        data, _ = self._recvbuf.read_all()
+        try:
+            for frame in self._parser.feed(data):
+                self._complete_frame(frame)
+                if self._state != c.StateConnected:
+                    break
+        except ProtocolError as error:
+            self._write_frame(c.OpcodeClose, error.code.to_bytes(2, "big"))
+            self._state = c.StageClosing
+            self._transport.close()
+        self._recvbuf.release()
+
+    def connection_lost(self, exc):
+        if self._handshake_timer is not None:
+            self._handshake_timer.cancel()
+        self._server._sessions.discard(self)
+        super().connection_lost(exc)
+
+    # frames and messages
+
+    def _complete_frame(self, frame):
+        if not frame.flag_mask:
+            raise ProtocolError(c.CloseProtocolError, "client frames must be masked")
+        opcode = frame.opcode
+        rsv = frame._flags_opcode & 0x70
+        if rsv and (rsv != 0x40 or self._deflate is None or opcode not in (c.OpcodeText, c.OpcodeBinary)):
+            raise ProtocolError(c.CloseProtocolError, "reserved bits set without a negotiated extension")
+        if opcode == c.OpcodePing:
+            # the payload may point into the receive buffer, which the transport may keep a view of until it is written
+            self._write_frame(c.OpcodePong, bytes(frame.payload))
+            frame.release()
+        elif opcode == c.OpcodeClose:
+            if frame.payload_length == 1:
+                raise ProtocolError(c.CloseProtocolError, "close frame with a 1-byte payload")
+            if self._state == c.StateConnected:
+                self._write_frame(c.OpcodeClose, bytes(frame.payload[:2]))
+                self._state = c.StageClosing
+            frame.release()
+            self._transport.close()
+        elif opcode == c.OpcodePong:
+            frame.release()
+        else:
+            message = self._assembler.feed(frame)
+            if message is not None:
+                self._queue_message(message[1])
+
+    def _write_frame(self, opcode, payload, rsv1=False):
+        self._transport.writelines([encode_header(opcode, len(payload), rsv1=rsv1), payload])
+
+    async def _run_handler(self):
+        try:
+            await self._server._handler(self)
+        finally:
+            await self.close()
+
+    # application interface
+
+    # Send a message (str as a text frame, bytes-like as a binary one), waiting while the transport's
+    # write buffer is above its high-water mark.
+    async def send(self, data):
+        if self._state != c.StateConnected:
+            raise ConnectionError("session is not connected")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+            opcode = c.OpcodeText
+        else:
+            opcode = c.OpcodeBinary
+        if self._deflate is not None and len(data) >= self._deflate.threshold:
+            self._write_frame(opcode, self._deflate.compress(data), rsv1=True)
+        else:
+            self._write_frame(opcode, data)
+        await self.drain()
+
+    async def close(self, code=1000):
+        if self._state == c.StateConnected:
+            self._write_frame(c.OpcodeClose, code.to_bytes(2, "big"))
+            self._state = c.StageClosing
+        if self._transport is not None:
+            self._transport.close()
+
+class AsyncWebsocketServer:
+    # handler: coroutine function called with each session once its handshake is done
+    # buffer_size: maximum size of the HTTP request header block, larger ones are refused with 431
+    # handshake_timeout: seconds a client gets to complete its upgrade request before it is disconnected
+    # max_frame_size, max_message_size: limits, in bytes, of received frames and (reassembled) messages
+    # deflate: a PerMessageDeflate to offer permessage-deflate compression (deflate.py), None to disable it
+    # max_queue: number of received messages buffered per session before reading is paused
+    # write_limits: (high, low) water marks of the transport write buffers, for send() flow control
+    def __init__(self, handler, buffer_size=8192, handshake_timeout=10.0, max_frame_size=1 << 24, max_message_size=1 << 26,
+                 deflate=None, max_queue=64, write_limits=(65536, 16384)):
+        self._handler = handler
+        self._buffer_size = buffer_size
+        self._handshake_timeout = handshake_timeout
+        self._max_frame_size = max_frame_size
+        self._max_message_size = max_message_size
+        self._deflate = deflate
+        self._max_queue = max_queue
+        self._write_high, self._write_low = write_limits
+        self._server = None
+        self._sessions = set()
+        self._pool = BufferPool() # receive and payload buffers of the sessions
+
+    async def listen(self, address="0.0.0.0", port=8080):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: AsyncWebsocketSession(self), address, port)
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        for sess in list(self._sessions):
+            await sess.close()
+        await self._server.wait_closed()
+
+    @property
+    def sessions(self):
+        return list(self._sessions)
+
+# Run a coroutine on uvloop if it is installed, on the default asyncio loop otherwise.
+def run(main):
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.run(main)
+    if hasattr(uvloop, "run"):
+        return uvloop.run(main)
+    uvloop.install()
+    return asyncio.run(main)
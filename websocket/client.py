@@ -0,0 +1,373 @@
+import asyncio, collections, contextlib, os
+
+from . import constants as c
+from . import handshake
+from .aio import AsyncWebsocketProtocol
+from .frame import FrameParser, ProtocolError, encode_header
+from .message import MessageAssembler
+from .mask import mask
+from .pool import BufferPool
+
+# asyncio websocket client, with a pool of connections to one server.
+# Connections share their protocol base with the sessions of the asyncio server (aio.py): the transport
+# receives straight into a RecvBuffer and the same frame parser and message assembler run on it, so any
+# number of connections are multiplexed on one event loop.
+#
+#     client = WebsocketClient("127.0.0.1", 8080)
+#     async with client.connection() as conn:
+#         await conn.send("hello")
+#         print(await conn.recv())
+#     await client.close()
+#
+# acquire() hands out an idle connection of the pool if there is one and opens a new one otherwise, waiting
+# while max_connections are in use; release() gives it back for reuse. Idle connections are pinged every
+# health_interval seconds, and the ones that do not answer within health_timeout are dropped.
+# connect() opens a connection that is not part of the pool.
+
+# Mask keys are cut out of a block of random bytes, rather than one urandom call per frame.
+class _MaskKeys:
+    __slots__ = ("_block", "_pos")
+    BLOCK_SIZE = 4096
+
+    def __init__(self):
+        self._block = b""
+        self._pos = 0
+
+    def next(self):
+        if self._pos == len(self._block):
+            self._block = os.urandom(self.BLOCK_SIZE)
+            self._pos = 0
+        self._pos += 4
+        return self._block[self._pos - 4:self._pos]
+
+class WebsocketConnection(AsyncWebsocketProtocol):
+    def __init__(self, client):
+        super().__init__(c.StateConnecting, client._pool, client._max_queue)
+        loop = asyncio.get_running_loop()
+        self._client = client
+        self._key = None # Sec-WebSocket-Key of the upgrade request
+        self._connected = loop.create_future() # done once the handshake is
+        self._lost = loop.create_future() # done once the connection is closed
+        self._timer = None # handshake or close deadline
+        self._pings = collections.deque() # (payload, future) of the pings waiting for their pong
+        self._ping_count = 0
+        self._last_used = 0 # loop time the connection was last given back to the pool
+        self.close_code = None # status code of the close frame received from the server
+
+    # asyncio protocol callbacks
+
+    def connection_made(self, transport):
+        client = self._client
+        self._transport = transport
+        transport.set_write_buffer_limits(client._write_high, client._write_low)
+        request, self._key = handshake.request(client._host_header, client._path, client._headers)
+        transport.write(request)
+        self._timer = asyncio.get_running_loop().call_later(client._handshake_timeout, self._expire_handshake)
+        client._connections.add(self)
+
+    def _expire_handshake(self):
+        self._connected.set_exception(ConnectionError("handshake timed out"))
+        self._transport.abort()
+
+    def buffer_updated(self, nbytes):
+        self._recvbuf.advance(nbytes)
+        if self._state == c.StateConnecting:
+            complete, error = handshake.check_response(self._recvbuf, self._key, self._client._buffer_size)
+            if not complete:
+                return
+            self._timer.cancel()
+            if error is not None:
+                self._connected.set_exception(ConnectionError(error))
+                self._transport.abort()
+                return
+            self._state = c.StateConnected
+            self._parser = FrameParser(max_frame_size=self._client._max_frame_size, pool=self._client._pool)
+            self._assembler = MessageAssembler(self._client._max_message_size)
+            self._connected.set_result(None)
+        # As on the server, payloads may point into the receive buffer: they are copied (or answered) right here.
+        data, _ = self._recvbuf.read_all()
+        try:
+            for frame in self._parser.feed(data):
+                self._complete_frame(frame)
+                if self._state == c.StateClosed:
+                    break
+        except ProtocolError as error:
+            if self._state == c.StateConnected:
+                self._write_frame(c.OpcodeClose, error.code.to_bytes(2, "big"))
+            self._state = c.StateClosed
+            self._transport.close()
+        self._recvbuf.release()
+
+    def connection_lost(self, exc):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._client._connections.discard(self)
+        if not self._connected.done():
+            self._connected.set_exception(ConnectionError("connection lost during the handshake"))
+        self._lost.set_result(None)
+        while self._pings:
+            _, waiter = self._pings.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("connection closed"))
+        super().connection_lost(exc)
+
+    # frames and messages
+
+    def _complete_frame(self, frame):
+        if frame.flag_mask:
+            raise ProtocolError(c.CloseProtocolError, "server frames must not be masked")
+        if frame._flags_opcode & 0x70:
+            raise ProtocolError(c.CloseProtocolError, "reserved bits set without a negotiated extension")
+        opcode = frame.opcode
+        if opcode == c.OpcodePing:
+            if self._state == c.StateConnected:
+                self._write_frame(c.OpcodePong, frame.payload)
+        elif opcode == c.OpcodeClose:
+            if frame.payload_length == 1:
+                raise ProtocolError(c.CloseProtocolError, "close frame with a 1-byte payload")
+            if frame.payload_length >= 2:
+                self.close_code = int.from_bytes(frame.payload[:2], "big")
+            if self._state == c.StateConnected:
+                self._write_frame(c.OpcodeClose, bytes(frame.payload[:2]))
+            # the server closes the TCP connection first, but nothing is left to wait for
+            self._state = c.StateClosed
+            self._transport.close()
+        elif opcode == c.OpcodePong:
+            self._pong(bytes(frame.payload))
+        elif self._state == c.StateConnected:
+            message = self._assembler.feed(frame)
+            if message is not None:
+                self._message(message[1])
+            return
+        # control frames, and data frames received after the close frame was sent
+        frame.release()
+
+    def _message(self, data):
+        on_message = self._client._on_message
+        if on_message is not None:
+            on_message(self, data)
+            return
+        self._queue_message(data)
+
+    # A pong answers the ping with the same payload, and every earlier ping still waiting.
+    def _pong(self, payload):
+        if not any(sent == payload for sent, _ in self._pings):
+            return # unsolicited
+        while self._pings:
+            sent, waiter = self._pings.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+            if sent == payload:
+                break
+
+    # Client frames are masked, so the payload is copied anyway: header and masked payload are built
+    # in a single buffer and written with a single call.
+    def _write_frame(self, opcode, payload):
+        maskkey = self._client._maskkeys.next()
+        header = encode_header(opcode, len(payload), maskkey=maskkey)
+        frame = bytearray(len(header) + len(payload))
+        frame[:len(header)] = header
+        frame[len(header):] = payload
+        mask(memoryview(frame)[len(header):], maskkey)
+        self._transport.write(frame)
+
+    # Send the close frame and leave the server close_timeout seconds to answer it.
+    def _start_close(self, code):
+        if self._state == c.StateConnected:
+            self._write_frame(c.OpcodeClose, code.to_bytes(2, "big"))
+            self._state = c.StageClosing
+            self._timer = asyncio.get_running_loop().call_later(self._client._close_timeout, self._transport.abort)
+        elif self._state == c.StateConnecting and self._transport is not None:
+            self._transport.abort()
+
+    # application interface
+
+    # Send a message (str as a text frame, bytes-like as a binary one), waiting while the transport's
+    # write buffer is above its high-water mark.
+    async def send(self, data):
+        self.send_nowait(data)
+        await self.drain()
+
+    # Send a message without waiting for the write buffer to drain, e.g. from an on_message callback.
+    def send_nowait(self, data):
+        if self._state != c.StateConnected:
+            raise ConnectionError("connection is not open")
+        if isinstance(data, str):
+            self._write_frame(c.OpcodeText, data.encode("utf-8"))
+        else:
+            self._write_frame(c.OpcodeBinary, data)
+
+    # Send a ping and wait for its pong, returns the round-trip time in seconds.
+    # Raises asyncio.TimeoutError if no pong arrives within `timeout` seconds.
+    async def ping(self, timeout=None):
+        if self._state != c.StateConnected:
+            raise ConnectionError("connection is not open")
+        loop = asyncio.get_running_loop()
+        self._ping_count += 1
+        payload = self._ping_count.to_bytes(4, "big")
+        waiter = loop.create_future()
+        self._pings.append((payload, waiter))
+        start = loop.time()
+        self._write_frame(c.OpcodePing, payload)
+        await asyncio.wait_for(waiter, timeout)
+        return loop.time() - start
+
+    # Close the connection and wait until the server has closed it (or close_timeout has passed).
+    async def close(self, code=1000):
+        self._start_close(code)
+        await asyncio.shield(self._lost)
+
+class WebsocketClient:
+    # host, port, path: server and resource every connection is opened to
+    # headers: extra request headers of the upgrade request, a dict
+    # max_connections: pooled connections in use at once, acquire() waits while they all are
+    # max_idle: idle connections kept for reuse (max_connections by default), the others are closed on release()
+    # health_interval: seconds between pings of the idle connections, None to disable the checks
+    # health_timeout: seconds an idle connection gets to answer its ping before it is dropped
+    # handshake_timeout: seconds the server gets to answer the upgrade request
+    # close_timeout: seconds the server gets to close the connection after the close frame
+    # buffer_size: maximum size of the HTTP response header block
+    # max_frame_size, max_message_size: limits, in bytes, of received frames and (reassembled) messages
+    # max_queue: number of received messages buffered per connection before reading is paused
+    # write_limits: (high, low) water marks of the transport write buffers, for send() flow control
+    # on_message: callable(connection, message) called on the event loop with every message received, instead
+    #     of queuing it for recv(); one callback can then drive any number of connections
+    def __init__(self, host="127.0.0.1", port=8080, path="/", headers=None, max_connections=100, max_idle=None,
+                 health_interval=30.0, health_timeout=10.0, handshake_timeout=10.0, close_timeout=5.0, buffer_size=8192,
+                 max_frame_size=1 << 24, max_message_size=1 << 26, max_queue=64, write_limits=(65536, 16384),
+                 on_message=None):
+        self._host = host
+        self._port = port
+        self._host_header = host if port == 80 else "%s:%d" % (host, port)
+        self._path = path
+        self._headers = headers
+        self._max_connections = max_connections
+        self._max_idle = max_connections if max_idle is None else max_idle
+        self._health_interval = health_interval
+        self._health_timeout = health_timeout
+        self._handshake_timeout = handshake_timeout
+        self._close_timeout = close_timeout
+        self._buffer_size = buffer_size
+        self._max_frame_size = max_frame_size
+        self._max_message_size = max_message_size
+        self._max_queue = max_queue
+        self._write_high, self._write_low = write_limits
+        self._on_message = on_message
+        self._pool = BufferPool() # receive and payload buffers of the connections
+        self._maskkeys = _MaskKeys()
+        self._connections = set() # every open connection, pooled or not
+        self._idle = collections.deque() # pooled connections waiting to be reused, the most recently used last
+        self._acquired = 0 # pooled connections handed out or being opened
+        self._waiters = collections.deque() # futures of the acquire() calls waiting for a connection
+        self._health_task = None
+        self._closed = False
+
+    @property
+    def connections(self):
+        return list(self._connections)
+
+    # Open a new connection, outside of the pool.
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        _, conn = await loop.create_connection(lambda: WebsocketConnection(self), self._host, self._port)
+        await conn._connected
+        return conn
+
+    # Take a connection from the pool.
+    async def acquire(self):
+        if self._closed:
+            raise ConnectionError("client is closed")
+        if self._health_task is None and self._health_interval is not None:
+            self._health_task = asyncio.get_running_loop().create_task(self._check_health())
+        while self._idle:
+            conn = self._idle.pop()
+            if conn._state == c.StateConnected:
+                self._acquired += 1
+                return conn
+        while self._acquired >= self._max_connections:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                conn = await waiter
+            except asyncio.CancelledError:
+                # release() may have handed over its connection (or slot) already
+                if waiter.done() and not waiter.cancelled():
+                    if waiter.result() is not None:
+                        self.release(waiter.result())
+                    else:
+                        self._wake()
+                raise
+            if conn is not None:
+                return conn # handed over by release(), still counted as acquired
+        self._acquired += 1
+        try:
+            return await self.connect()
+        except BaseException:
+            self._acquired -= 1
+            self._wake()
+            raise
+
+    # Give a connection taken with acquire() back to the pool.
+    def release(self, conn):
+        self._acquired -= 1
+        if conn._state != c.StateConnected or self._closed:
+            conn._start_close(c.CloseGoingAway)
+            self._wake()
+            return
+        conn._last_used = asyncio.get_running_loop().time()
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._acquired += 1
+                waiter.set_result(conn)
+                return
+        if len(self._idle) < self._max_idle:
+            self._idle.append(conn)
+        else:
+            conn._start_close(c.CloseGoingAway)
+
+    # Let a waiting acquire() open a new connection.
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    async def _check_health(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._health_interval)
+            # connections idle for a whole interval are taken out of the pool while they are pinged
+            deadline = loop.time() - self._health_interval
+            stale = [conn for conn in self._idle if conn._last_used <= deadline]
+            if not stale:
+                continue
+            self._idle = collections.deque(conn for conn in self._idle if conn._last_used > deadline)
+            self._acquired += len(stale)
+            results = await asyncio.gather(*[conn.ping(self._health_timeout) for conn in stale], return_exceptions=True)
+            for conn, result in zip(stale, results):
+                if isinstance(result, BaseException) and conn._transport is not None:
+                    conn._transport.abort()
+                    conn._state = c.StateClosed
+                self.release(conn)
+
+    # Close every connection, pooled or not; acquire() cannot be used anymore.
+    async def close(self):
+        self._closed = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+        self._idle.clear()
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(ConnectionError("client is closed"))
+        await asyncio.gather(*[conn.close(c.CloseGoingAway) for conn in list(self._connections)])
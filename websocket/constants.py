@@ -1,17 +1,51 @@
-StateUnconnected = 0
-StateConnecting = 1
-StateConnected = 2
-StageClosing = 3
-StateClosed = 4
-
-from .const import Constants
-
-class consts(Constants):
-    StateUnconnected = 0
-    StateConnecting = 1
-    StateConnected = 2
-    StageClosing = 3
-    StateClosed = 4
-        
-import sys
-sys.modules[__name__] = consts()
+StateUnconnected = 0
+StateConnecting = 1
+StateConnected = 2
+StageClosing = 3
+StateClosed = 4
+
+OpcodeContinuation = 0x0
+OpcodeText = 0x1
+OpcodeBinary = 0x2
+OpcodeClose = 0x8
+OpcodePing = 0x9
+OpcodePong = 0xa
+
+CloseNormal = 1000
+CloseGoingAway = 1001
+CloseProtocolError = 1002
+CloseUnsupportedData = 1003
+CloseNoStatus = 1005
+CloseInvalidPayload = 1007
+ClosePolicyViolation = 1008
+CloseMessageTooBig = 1009
+CloseInternalError = 1011
+
+from .const import Constants
+
+class consts(Constants):
+    StateUnconnected = 0
+    StateConnecting = 1
+    StateConnected = 2
+    StageClosing = 3
+    StateClosed = 4
+
+    OpcodeContinuation = 0x0
+    OpcodeText = 0x1
+    OpcodeBinary = 0x2
+    OpcodeClose = 0x8
+    OpcodePing = 0x9
+    OpcodePong = 0xa
+
+    CloseNormal = 1000
+    CloseGoingAway = 1001
+    CloseProtocolError = 1002
+    CloseUnsupportedData = 1003
+    CloseNoStatus = 1005
+    CloseInvalidPayload = 1007
+    ClosePolicyViolation = 1008
+    CloseMessageTooBig = 1009
+    CloseInternalError = 1011
+        
+import sys
+sys.modules[__name__] = consts()
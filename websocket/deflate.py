@@ -0,0 +1,142 @@
+import zlib
+
+from . import constants as c
+from .frame import ProtocolError
+
+# permessage-deflate extension, RFC 7692.
+# PerMessageDeflate holds the server's settings and negotiates them with each client's offer during the
+# handshake; every session that accepted the extension gets its own DeflateSession with its zlib streams.
+
+EXTENSION = "permessage-deflate"
+_TRAILER = b"\x00\x00\xff\xff" # end of a sync flush, stripped from every compressed message
+
+class PerMessageDeflate:
+    # window_bits: LZ77 window of the server's compressor (9..15); the client may ask for less
+    # client_window_bits: window the client is asked to use, if it offers client_max_window_bits (9..15)
+    # mem_level, compression_level: zlib settings of the server's compressor
+    # server_no_context_takeover: reset the compressor after every message (less memory, worse ratio);
+    #     also done whenever the client asks for it
+    # client_no_context_takeover: ask the client to reset its compressor after every message, which lets the
+    #     server drop its decompression window between messages
+    # threshold: messages shorter than this are sent uncompressed
+    def __init__(self, window_bits=15, client_window_bits=15, mem_level=8, compression_level=6,
+                 server_no_context_takeover=False, client_no_context_takeover=False, threshold=128):
+        if not 9 <= window_bits <= 15 or not 9 <= client_window_bits <= 15:
+            raise ValueError("window bits must be between 9 and 15")
+        self.window_bits = window_bits
+        self.client_window_bits = client_window_bits
+        self.mem_level = mem_level
+        self.compression_level = compression_level
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.threshold = threshold
+
+    # Pick the first acceptable offer of a Sec-WebSocket-Extensions header value.
+    # Returns (response extension string, DeflateSession), or (None, None) if nothing is acceptable.
+    def negotiate(self, header):
+        for offer in header.split(","):
+            params = [param.strip() for param in offer.split(";")]
+            if params[0].lower() != EXTENSION:
+                continue
+            accepted = self._accept(params[1:])
+            if accepted is not None:
+                return accepted
+        return None, None
+
+    def _accept(self, params):
+        server_bits = self.window_bits
+        client_bits = None # the client did not offer client_max_window_bits: it uses 15
+        server_no_context = self.server_no_context_takeover
+        client_no_context = self.client_no_context_takeover
+        seen = set()
+        for param in params:
+            name, _, value = param.partition("=")
+            name = name.strip().lower()
+            value = value.strip().strip('"')
+            if name in seen:
+                return None
+            seen.add(name)
+            if name == "server_no_context_takeover" and not value:
+                server_no_context = True
+            elif name == "client_no_context_takeover" and not value:
+                # a hint that the client resets its compressor anyway, even if the response does not ask for it
+                client_no_context = True
+            elif name == "server_max_window_bits":
+                if not value.isdigit() or not 8 <= int(value) <= 15:
+                    return None
+                if int(value) < 9:
+                    # zlib cannot produce raw deflate streams with a 256-byte window
+                    return None
+                server_bits = min(server_bits, int(value))
+            elif name == "client_max_window_bits":
+                if value and (not value.isdigit() or not 8 <= int(value) <= 15):
+                    return None
+                client_bits = min(self.client_window_bits, int(value) if value else 15)
+            else:
+                return None
+        response = [EXTENSION]
+        if server_no_context:
+            response.append("server_no_context_takeover")
+        if self.client_no_context_takeover:
+            response.append("client_no_context_takeover")
+        if "server_max_window_bits" in seen or server_bits < 15:
+            response.append("server_max_window_bits=%d" % server_bits)
+        if client_bits is not None and client_bits < 15:
+            response.append("client_max_window_bits=%d" % client_bits)
+        session = DeflateSession(self, server_bits, client_bits or 15, server_no_context, client_no_context)
+        return "; ".join(response), session
+
+# The zlib streams of one session.
+class DeflateSession:
+    def __init__(self, options, server_bits, client_bits, server_no_context, client_no_context):
+        self.threshold = options.threshold
+        self._level = options.compression_level
+        self._mem_level = options.mem_level
+        self._server_bits = server_bits
+        self._client_bits = client_bits
+        self._server_no_context = server_no_context
+        self._client_no_context = client_no_context
+        self._compressor = None
+        self._decompressor = None
+
+    # Identifies the compressor settings when no context is carried over between messages: messages compressed
+    # for sessions with the same key are then identical, which lets a broadcast compress once for all of them.
+    @property
+    def shared_key(self):
+        if not self._server_no_context:
+            return None
+        return (self._level, self._mem_level, self._server_bits)
+
+    def compress(self, data):
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, -self._server_bits, self._mem_level)
+        data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        # The compressor is dropped when no context is carried over, so that idle sessions hold no zlib state.
+        self._compressor = None if self._server_no_context else compressor
+        if data.endswith(_TRAILER):
+            data = data[:-4]
+        return data
+
+    # Decompress (a piece of) a message. `final` marks its last piece; at most `max_size` bytes
+    # (None for no limit) may come out, or ProtocolError(1009) is raised.
+    def decompress(self, data, final, max_size=None):
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = self._decompressor = zlib.decompressobj(-self._client_bits)
+        try:
+            if max_size is None:
+                output = decompressor.decompress(data)
+                if final:
+                    output += decompressor.decompress(_TRAILER)
+            else:
+                output = decompressor.decompress(data, max_size + 1)
+                if final and len(output) <= max_size and not decompressor.unconsumed_tail:
+                    output += decompressor.decompress(_TRAILER, max_size + 1 - len(output))
+                if len(output) > max_size or decompressor.unconsumed_tail:
+                    raise ProtocolError(c.CloseMessageTooBig, "decompressed message exceeds the limit of %d bytes" % max_size)
+        except zlib.error:
+            raise ProtocolError(c.CloseInvalidPayload, "invalid compressed data")
+        if final and self._client_no_context:
+            self._decompressor = None
+        return output
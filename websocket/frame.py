@@ -1,123 +1,274 @@
-def is_bytes(arg):
-    return isinstance(arg, bytes) or isinstance(arg, bytearray) or isinstance(arg, memoryview)
-
-class WebsocketFrame:
-    def __init__(self):
-        self._m_field_flags_opcode = None
-        self._m_field_mask_len = None
-        self._m_field_len2 = None
-        self._m_field_len6 = None
-        self._m_field_maskkey = None
-        self._payload_buffer = None
-        self._payload_bytesrecved = 0
-
-    @property
-    def _field_flags_opcode(self):
-        return self._m_field_flags_opcode
-    @_field_flags_opcode.setter
-    def _field_flags_opcode(self, value):
-        if value is None:
-            self._m_field_flags_opcode = None
-        elif is_bytes(value):
-            self._m_field_flags_opcode = int.from_bytes(value, 'big')
-        else:
-            raise ValueError("field must be a bytes-like object")
-    @property
-    def _field_mask_len(self):
-        return self._m_field_mask_len
-    @_field_mask_len.setter
-    def _field_flags_opcode(self, value):
-        if value is None:
-            self._m_field_flags_opcode = None
-        elif is_bytes(value):
-            self._m_field_flags_opcode = int.from_bytes(value, 'big')
-        else:
-            raise ValueError("field must be a bytes-like object")
-    @property
-    def _field_len2(self):
-        return self._m_field_len2
-    @_field_len2.setter
-    def _field_flags_opcode(self, value):
-        if value is None:
-            self._m_field_flags_opcode = None
-        elif is_bytes(value):
-            self._m_field_flags_opcode = int.from_bytes(value, 'big')
-        else:
-            raise ValueError("field must be a bytes-like object")
-    @property
-    def _field_len6(self):
-        return self._m_field_len6
-    @_field_len6.setter
-    def _field_flags_opcode(self, value):
-        if value is None:
-            self._m_field_flags_opcode = None
-        elif is_bytes(value):
-            self._m_field_flags_opcode = int.from_bytes(value, 'big')
-        else:
-            raise ValueError("field must be a bytes-like object")
-    @property
-    def _field_maskkey(self):
-        return self._m_field_maskkey
-    @_field_maskkey.setter
-    def _field_flags_opcode(self, value):
-        if value is None:
-            self._m_field_flags_opcode = None
-        elif is_bytes(value):
-            self._m_field_flags_opcode = int.from_bytes(value, 'big')
-        else:
-            raise ValueError("field must be a bytes-like object")
-
-    @property
-    def flag_fin(self):
-        if self._field_flags_opcode is None:
-            return None
-        return bool(self._field_flags_opcode & 0x80)
-    @property
-    def flag_rsv1(self):
-        if self._field_flags_opcode is None:
-            return None
-        return bool(self._field_flags_opcode & 0x40)
-    @property
-    def flag_rsv2(self):
-        if self._field_flags_opcode is None:
-            return None
-        return bool(self._field_flags_opcode & 0x20)
-    @property
-    def flag_rsv3(self):
-        if self._field_flags_opcode is None:
-            return None
-        return bool(self._field_flags_opcode & 0x10)
-    @property
-    def opcode(self):
-        if self._field_flags_opcode is None:
-            return None
-        return int(self._field_flags_opcode & 0x0f)
-    @property
-    def flag_mask(self):
-        if self._field_mask_len is None:
-            return None
-        return bool(self._field_mask_len & 0x80)
-    @property
-    def payload_length(self):
-        if self._field_mask_len is None:
-            return None
-        length = int(self._field_mask_len & 0x7f)
-        if length < 126:
-            return length
-        if self._field_len2 is None:
-            return None
-        length2 = int(self._field_len2)
-        if length == 126:
-            return length2
-        if self._field_len6 is None:
-            return None
-        length6 = int(self._field_len6)
-        if length == 127:
-            return (length2 << (6*8)) + length6
-        return None
-    @property
-    def maskkey(self):
-        if self._field_maskkey is None:
-            return None
-        return int(self._field_maskkey)
-        
\ No newline at end of file
+import struct
+
+from . import constants as c
+from .mask import unmask
+
+# A violation of the protocol by the peer; `code` is the status code to close the connection with.
+class ProtocolError(ValueError):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class WebsocketFrame:
+    __slots__ = ("_flags_opcode", "_mask_len", "_payload_length", "_maskkey", "_payload_buffer", "_payload_bytesrecved",
+                 "_payload_offset", "_payload_owned", "_payload_pool")
+
+    def __init__(self, flags_opcode=None, mask_len=None, payload_length=None, maskkey=None):
+        self._flags_opcode = flags_opcode
+        self._mask_len = mask_len
+        self._payload_length = payload_length
+        self._maskkey = maskkey # the 4 raw key bytes
+        self._payload_buffer = None
+        self._payload_bytesrecved = 0
+        self._payload_offset = 0 # position of _payload_buffer within the whole payload
+        self._payload_owned = False # whether _payload_buffer is private memory rather than a view of a fed chunk
+        self._payload_pool = None # the BufferPool _payload_buffer was taken from
+
+    @property
+    def flag_fin(self):
+        if self._flags_opcode is None:
+            return None
+        return bool(self._flags_opcode & 0x80)
+    @property
+    def flag_rsv1(self):
+        if self._flags_opcode is None:
+            return None
+        return bool(self._flags_opcode & 0x40)
+    @property
+    def flag_rsv2(self):
+        if self._flags_opcode is None:
+            return None
+        return bool(self._flags_opcode & 0x20)
+    @property
+    def flag_rsv3(self):
+        if self._flags_opcode is None:
+            return None
+        return bool(self._flags_opcode & 0x10)
+    @property
+    def opcode(self):
+        if self._flags_opcode is None:
+            return None
+        return int(self._flags_opcode & 0x0f)
+    @property
+    def flag_mask(self):
+        if self._mask_len is None:
+            return None
+        return bool(self._mask_len & 0x80)
+    @property
+    def payload_length(self):
+        return self._payload_length
+    @property
+    def maskkey(self):
+        if self._maskkey is None:
+            return None
+        return int.from_bytes(self._maskkey, "big")
+    # The (unmasked) payload. For a frame delivered in pieces (see FrameParser's streaming mode) this is
+    # the piece starting at payload_offset. It may be a view into the buffer that was fed to the parser.
+    @property
+    def payload(self):
+        return self._payload_buffer
+    @property
+    def payload_offset(self):
+        return self._payload_offset
+    # Whether the payload (or piece) ends the frame's payload.
+    @property
+    def payload_complete(self):
+        return self._payload_bytesrecved == self._payload_length
+
+    # Give a payload buffer taken from a pool back, once the payload has been consumed (or copied).
+    def release(self):
+        if self._payload_pool is not None:
+            self._payload_pool.release(self._payload_buffer.obj)
+            self._payload_pool = None
+            self._payload_buffer = None
+
+# Header layouts, indexed by the second header byte (mask bit + 7-bit length).
+# Each one decodes the whole header, including the extended length and the mask key, in a single unpack.
+_HEADER_SHORT = struct.Struct("!BB")
+_HEADER_SHORT_MASKED = struct.Struct("!BB4s")
+_HEADER_LEN16 = struct.Struct("!BBH")
+_HEADER_LEN16_MASKED = struct.Struct("!BBH4s")
+_HEADER_LEN64 = struct.Struct("!BBQ")
+_HEADER_LEN64_MASKED = struct.Struct("!BBQ4s")
+_HEADERS = [_HEADER_SHORT] * 126 + [_HEADER_LEN16, _HEADER_LEN64] \
+         + [_HEADER_SHORT_MASKED] * 126 + [_HEADER_LEN16_MASKED, _HEADER_LEN64_MASKED]
+MAX_HEADER_SIZE = _HEADER_LEN64_MASKED.size
+
+# Size of the header of a frame with a payload of `length` bytes.
+def header_size(length, masked=False):
+    size = 2 if length < 126 else 4 if length < 0x10000 else 10
+    return size + 4 if masked else size
+
+# Write the header of a frame with a payload of `length` bytes into `buffer` (a writable bytes-like object
+# with at least header_size() bytes from `offset`), returns the offset right after it.
+def encode_header_into(buffer, offset, opcode, length, fin=True, rsv1=False, maskkey=None):
+    flags_opcode = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    mask = 0x80 if maskkey is not None else 0
+    if length < 126:
+        _HEADER_SHORT.pack_into(buffer, offset, flags_opcode, mask | length)
+        offset += 2
+    elif length < 0x10000:
+        _HEADER_LEN16.pack_into(buffer, offset, flags_opcode, mask | 126, length)
+        offset += 4
+    else:
+        _HEADER_LEN64.pack_into(buffer, offset, flags_opcode, mask | 127, length)
+        offset += 10
+    if maskkey is not None:
+        buffer[offset:offset + 4] = maskkey
+        offset += 4
+    return offset
+
+# Build a frame header for a payload of `length` bytes.
+def encode_header(opcode, length, fin=True, rsv1=False, maskkey=None):
+    flags_opcode = (0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode
+    mask = 0x80 if maskkey is not None else 0
+    if length < 126:
+        header = _HEADER_SHORT.pack(flags_opcode, mask | length)
+    elif length < 0x10000:
+        header = _HEADER_LEN16.pack(flags_opcode, mask | 126, length)
+    else:
+        header = _HEADER_LEN64.pack(flags_opcode, mask | 127, length)
+    if maskkey is not None:
+        header += maskkey
+    return header
+
+# Incremental (sans-IO) frame parser.
+# Feed it whatever bytes have been received and it returns the frames completed by them; partial headers
+# and payloads are kept until the rest arrives. When a chunk holds a whole payload, the frame's payload is
+# a memoryview slice of that chunk rather than a copy: it stays valid only as long as the chunk's memory
+# is not reused, so consumers that keep payloads around must copy them.
+# With `unmask`, masked payloads are unmasked in place (chunks that are read-only get copied first).
+# Frames announcing more than `max_frame_size` payload bytes are refused before anything is allocated.
+# Payloads that have to be buffered because they span several chunks are taken from `pool` (a BufferPool)
+# if given; the consumer of such a frame calls its release() once done with the payload.
+# In `streaming` mode the payload of a data frame is never buffered: every piece of it is returned as soon
+# as it has been fed, as a frame object whose payload is the piece (see payload_offset / payload_complete).
+class FrameParser:
+    __slots__ = ("_unmask", "_max_frame_size", "_streaming", "_pool", "_header", "_frame")
+
+    def __init__(self, unmask=True, max_frame_size=None, streaming=False, pool=None):
+        self._unmask = unmask
+        self._max_frame_size = max_frame_size
+        self._streaming = streaming
+        self._pool = pool
+        self._header = bytearray() # header bytes that arrived without the rest of the header
+        self._frame = None # frame whose payload is being received
+
+    # Parse `data` (a bytes-like object), returns the list of completed frames (or frame pieces).
+    # Raises ProtocolError if the data is not a valid frame sequence.
+    def feed(self, data):
+        view = memoryview(data).cast("B")
+        frames = []
+        pos = 0
+        end = len(view)
+        while True:
+            if self._frame is None:
+                pos = self._parse_header(view, pos)
+                if self._frame is None:
+                    break
+            frame = self._frame
+            received = frame._payload_bytesrecved
+            remain = frame._payload_length - received
+            if received == 0 and frame._payload_buffer is None and end - pos >= remain:
+                # the whole payload is inside this chunk: hand out a slice of it
+                frame._payload_buffer = self._take(view[pos:pos + remain], frame, 0)
+                length = remain
+            elif self._streaming and frame._flags_opcode & 0x08 == 0:
+                # hand out the piece received so far, without buffering it
+                length = min(remain, end - pos)
+                if length == 0:
+                    break
+                piece = WebsocketFrame(frame._flags_opcode, frame._mask_len, frame._payload_length, frame._maskkey)
+                piece._payload_buffer = self._take(view[pos:pos + length], piece, received)
+                piece._payload_offset = received
+                piece._payload_bytesrecved = received + length
+                frames.append(piece)
+                pos += length
+                frame._payload_bytesrecved += length
+                if frame._payload_bytesrecved < frame._payload_length:
+                    break
+                self._frame = None
+                continue
+            else:
+                if frame._payload_buffer is None:
+                    if pos == end:
+                        # the header ended the chunk: the payload may still come whole in the next one
+                        break
+                    length = frame._payload_length
+                    if self._pool is not None and length <= self._pool.max_size:
+                        frame._payload_buffer = memoryview(self._pool.acquire(length))[:length]
+                        frame._payload_pool = self._pool
+                    else:
+                        frame._payload_buffer = memoryview(bytearray(length))
+                    frame._payload_owned = True
+                length = min(remain, end - pos)
+                chunk = frame._payload_buffer[received:received + length]
+                chunk[:] = view[pos:pos + length]
+                # carry the mask offset over from the pieces received before
+                if self._unmask and frame._maskkey is not None:
+                    unmask(chunk, frame._maskkey, received)
+            pos += length
+            frame._payload_bytesrecved += length
+            if frame._payload_bytesrecved < frame._payload_length:
+                break
+            frames.append(frame)
+            self._frame = None
+        return frames
+
+    # Unmask a payload slice of a fed chunk in place, copying it first if the chunk is read-only.
+    def _take(self, payload, frame, offset):
+        if self._unmask and frame._maskkey is not None and len(payload) > 0:
+            if payload.readonly:
+                payload = memoryview(bytearray(payload))
+                frame._payload_owned = True
+            unmask(payload, frame._maskkey, offset)
+        return payload
+    # Decode a frame header starting at view[pos], returns the position after it.
+    # Sets self._frame when the header is complete, stashes the bytes in self._header otherwise.
+    def _parse_header(self, view, pos):
+        end = len(view)
+        if self._header:
+            # complete the stashed header first
+            take = min(MAX_HEADER_SIZE - len(self._header), end - pos)
+            header = self._header + view[pos:pos + take]
+            consumed = self._decode_header(header, 0)
+            if consumed == 0:
+                self._header = header
+                return end
+            self._header = bytearray()
+            return pos + consumed - (len(header) - take)
+        consumed = self._decode_header(view, pos)
+        if consumed == 0:
+            self._header = bytearray(view[pos:])
+            return end
+        return pos + consumed
+
+    def _decode_header(self, buffer, pos):
+        if len(buffer) - pos < 2:
+            return 0
+        header = _HEADERS[buffer[pos + 1]]
+        if len(buffer) - pos < header.size:
+            return 0
+        fields = header.unpack_from(buffer, pos)
+        mask_len = fields[1]
+        length = mask_len & 0x7f
+        maskkey = None
+        if mask_len & 0x80:
+            maskkey = fields[-1]
+        if length >= 126:
+            length = fields[2]
+            if length >> 63:
+                raise ProtocolError(c.CloseProtocolError, "the most significant bit of a 64-bit payload length must be 0")
+        flags_opcode = fields[0]
+        opcode = flags_opcode & 0x0f
+        if opcode & 0x08:
+            if opcode > c.OpcodePong:
+                raise ProtocolError(c.CloseProtocolError, "reserved control opcode <%d>" % opcode)
+            if length > 125 or not flags_opcode & 0x80:
+                raise ProtocolError(c.CloseProtocolError, "control frames must be final and at most 125 bytes long")
+        elif opcode > c.OpcodeBinary:
+            raise ProtocolError(c.CloseProtocolError, "reserved data opcode <%d>" % opcode)
+        if self._max_frame_size is not None and length > self._max_frame_size:
+            raise ProtocolError(c.CloseMessageTooBig, "frame of %d bytes exceeds the limit of %d" % (length, self._max_frame_size))
+        self._frame = WebsocketFrame(flags_opcode, mask_len, length, maskkey)
+        return header.size
@@ -0,0 +1,124 @@
+import hashlib, base64, os
+
+from . import constants as c
+from . import socketio as io
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+RESPONSE_400 = b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n"
+RESPONSE_405 = b"HTTP/1.1 405 Method Not Allowed\r\nAllow: GET\r\nConnection: close\r\n\r\n"
+RESPONSE_426 = b"HTTP/1.1 426 Upgrade Required\r\nSec-WebSocket-Version: 13\r\nConnection: close\r\n\r\n"
+RESPONSE_431 = b"HTTP/1.1 431 Request Header Fields Too Large\r\nConnection: close\r\n\r\n"
+# filled in with the accept key and the extension header line (or nothing)
+RESPONSE_101 = b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: %s\r\n%s\r\n"
+
+# The only request headers the handshake looks at, by lower-case name.
+HEADERS = frozenset([b"connection", b"upgrade", b"sec-websocket-version", b"sec-websocket-key", b"sec-websocket-extensions"])
+
+def accept_key(seckey):
+    secaccept = hashlib.sha1()
+    secaccept.update(seckey.encode("ascii") + GUID)
+    return base64.b64encode(secaccept.digest())
+
+def _has_token(value, token):
+    return any(item.strip().lower() == token for item in value.split(","))
+
+# Drive the HTTP upgrade handshake of a session from its receive buffer.
+# Nothing is parsed until the whole header block (up to the empty line) has been received, then it is
+# handled in one pass; a block longer than `maxlen` bytes is refused with 431.
+# `sess` is any session object with `_state`, `_reqline` and `_headers`; both the threaded and the asyncio
+# server use it. `_headers` gets the headers the handshake needs, by lower-case name.
+# With `deflate` (a PerMessageDeflate), the permessage-deflate extension is negotiated and the session's
+# `_deflate` is set to its DeflateSession, or None if the client did not offer anything acceptable.
+# Returns `(response, accepted)`: response is None while more data is needed. Once the handshake is accepted
+# the session state is StateConnected; a rejected handshake leaves the state alone, and the caller
+# should close the connection after writing the response.
+def process(sess, buf, maxlen, deflate=None):
+    block, error = buf.read_until(b"\r\n\r\n", maxlen)
+    if error == io.e.ErrorBufferOverflow:
+        return RESPONSE_431, False
+    elif error == io.e.ErrorStreamEmpty:
+        return None, False
+    lines = block[:-4].split(b"\r\n")
+    # HTTP request line format:
+    #     <method> <url> HTTP/<version>
+    # Note that method must be 'GET'.
+    reqline = lines[0].split()
+    if len(reqline) != 3 or not reqline[2].startswith(b"HTTP/1."):
+        return RESPONSE_400, False
+    if reqline[0] != b"GET":
+        return RESPONSE_405, False
+    headers = sess._headers
+    for line in lines[1:]:
+        name, colon, value = line.partition(b":")
+        if not colon:
+            return RESPONSE_400, False
+        name = name.strip().lower()
+        if name in HEADERS:
+            try:
+                value = value.strip().decode("ascii")
+            except UnicodeError:
+                return RESPONSE_400, False
+            name = name.decode("ascii")
+            # repeated headers are combined into one comma-separated list
+            headers[name] = headers[name] + ", " + value if name in headers else value
+    # The header block is complete: check that it is a valid websocket request, then answer it.
+    if not _has_token(headers.get("connection", ""), "upgrade") \
+            or not _has_token(headers.get("upgrade", ""), "websocket") \
+            or len(headers.get("sec-websocket-key", "")) != 24:
+        return RESPONSE_400, False
+    if headers.get("sec-websocket-version") != "13":
+        return RESPONSE_426, False
+    sess._reqline = (reqline[0].decode("ascii"), reqline[1].decode("latin-1"), reqline[2].decode("ascii"))
+    extension = b""
+    sess._deflate = None
+    if deflate is not None and "sec-websocket-extensions" in headers:
+        offer, sess._deflate = deflate.negotiate(headers["sec-websocket-extensions"])
+        if offer is not None:
+            extension = b"Sec-WebSocket-Extensions: " + offer.encode("ascii") + b"\r\n"
+    sess._state = c.StateConnected
+    return RESPONSE_101 % (accept_key(headers["sec-websocket-key"]), extension), True
+
+# Client side: the upgrade request for `path` on `host`, with a fresh random key and the extra `headers`
+# (a dict). Returns `(request, key)`, the key is needed to check the response.
+def request(host, path="/", headers=None):
+    key = base64.b64encode(os.urandom(16))
+    lines = [b"GET " + path.encode("latin-1") + b" HTTP/1.1", b"Host: " + host.encode("latin-1"),
+             b"Connection: Upgrade", b"Upgrade: websocket", b"Sec-WebSocket-Version: 13", b"Sec-WebSocket-Key: " + key]
+    if headers:
+        for name, value in headers.items():
+            lines.append(name.encode("latin-1") + b": " + value.encode("latin-1"))
+    return b"\r\n".join(lines) + b"\r\n\r\n", key.decode("ascii")
+
+# Check the server's response to request() from a receive buffer, like process() does for the request.
+# Returns `(complete, error)`: complete is False while more data is needed, error is None if the server
+# accepted the upgrade, a description of what is wrong with the response otherwise.
+def check_response(buf, key, maxlen):
+    block, error = buf.read_until(b"\r\n\r\n", maxlen)
+    if error == io.e.ErrorBufferOverflow:
+        return True, "response header block too large"
+    elif error == io.e.ErrorStreamEmpty:
+        return False, None
+    lines = block[:-4].split(b"\r\n")
+    status = lines[0].split(None, 2)
+    if len(status) < 2 or not status[0].startswith(b"HTTP/1."):
+        return True, "malformed status line"
+    if status[1] != b"101":
+        return True, "upgrade refused: " + lines[0].decode("latin-1")
+    headers = {}
+    for line in lines[1:]:
+        name, colon, value = line.partition(b":")
+        if not colon:
+            return True, "malformed header line"
+        name = name.strip().lower()
+        value = value.strip().decode("latin-1")
+        headers[name] = headers[name] + ", " + value if name in headers else value
+    if not _has_token(headers.get(b"connection", ""), "upgrade") \
+            or not _has_token(headers.get(b"upgrade", ""), "websocket"):
+        return True, "response does not upgrade to websocket"
+    if headers.get(b"sec-websocket-accept", "").encode("latin-1") != accept_key(key):
+        return True, "wrong Sec-WebSocket-Accept"
+    # no extension is offered, so the server must not accept one
+    if b"sec-websocket-extensions" in headers:
+        return True, "extension accepted without being offered"
+    return True, None
@@ -0,0 +1,144 @@
+import argparse, asyncio, array, collections, multiprocessing, resource, time
+
+from . import aio
+from .client import WebsocketClient
+
+# Load generator: opens N connections to a server that echoes messages back, keeps `window` messages
+# in flight on each of them for a while, and reports the throughput and the round-trip latencies.
+# All connections are driven by one on_message callback on a single event loop.
+#
+#     python -m websocket.loadgen --port 8080 --connections 1000 --duration 10 --size 64
+#     python -m websocket.loadgen --serve --connections 100
+#
+# With --serve, a threaded WebsocketServer echoing every message is started in a child process first.
+
+class LoadGenerator:
+    def __init__(self, message, window):
+        self.message = message
+        self.window = window
+        self.running = True
+        self.recording = False # latencies and counts are only kept once the warm-up is over
+        self.samples = array.array("d") # round-trip times, in seconds
+        self.received = 0
+        self._sent = {} # connection -> deque of the send times of its messages in flight
+
+    def start(self, conn):
+        sent = self._sent[conn] = collections.deque()
+        for _ in range(self.window):
+            sent.append(time.perf_counter())
+            conn.send_nowait(self.message)
+
+    def on_message(self, conn, message):
+        now = time.perf_counter()
+        sent = self._sent[conn]
+        if self.recording:
+            self.samples.append(now - sent.popleft())
+            self.received += 1
+        else:
+            sent.popleft()
+        if self.running:
+            sent.append(now)
+            conn.send_nowait(self.message)
+
+    def in_flight(self):
+        return sum(map(len, self._sent.values()))
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+def serve(host, port, ready):
+    from .server import WebsocketServer
+    server = WebsocketServer(on_message=lambda sess, message: sess.send(message))
+    server.listen(host, port, backlog=1024)
+    ready.set()
+    time.sleep(1 << 30)
+
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+# Run the load and return the results: a dict with the number of connections opened ("connections") and
+# failed ("failed"), the time the handshakes took ("connect_time"), the messages echoed while measuring
+# ("messages") in "elapsed" seconds, and their sorted round-trip times in seconds ("latencies").
+async def generate(host="127.0.0.1", port=8080, path="/", connections=100, duration=10.0, warmup=1.0, size=64,
+                   window=1, text=False, concurrency=100):
+    message = b"x" * size
+    if text:
+        message = message.decode("ascii")
+    generator = LoadGenerator(message, window)
+    client = WebsocketClient(host, port, path, max_connections=connections, health_interval=None,
+                             on_message=generator.on_message)
+    # open the connections a batch at a time, so the server's listen backlog does not overflow
+    handshakes = asyncio.Semaphore(concurrency)
+    async def acquire():
+        async with handshakes:
+            return await client.acquire()
+    start = time.perf_counter()
+    results = await asyncio.gather(*[acquire() for _ in range(connections)], return_exceptions=True)
+    connect_time = time.perf_counter() - start
+    conns = [conn for conn in results if not isinstance(conn, BaseException)]
+    elapsed = 0.0
+    if conns:
+        for conn in conns:
+            generator.start(conn)
+        await asyncio.sleep(warmup)
+        generator.recording = True
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - start
+        generator.recording = False
+        generator.running = False
+        # let the messages in flight come back before closing
+        deadline = time.perf_counter() + 5.0
+        while generator.in_flight() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        for conn in conns:
+            client.release(conn)
+    await client.close()
+    return {"connections": len(conns), "failed": len(results) - len(conns), "connect_time": connect_time,
+            "messages": generator.received, "elapsed": elapsed, "latencies": sorted(generator.samples)}
+
+async def run(args):
+    result = await generate(args.host, args.port, args.path, args.connections, args.duration, args.warmup, args.size,
+                            args.window, args.text, args.concurrency)
+    print("%d connections opened in %.2f s (%.0f handshakes/s), %d failed"
+          % (result["connections"], result["connect_time"], result["connections"] / result["connect_time"],
+             result["failed"]))
+    if not result["connections"]:
+        return
+    messages, elapsed, samples = result["messages"], result["elapsed"], result["latencies"]
+    print("%d messages of %d bytes in %.2f s, window %d per connection" % (messages, args.size, elapsed, args.window))
+    print("%12s %14s" % ("messages/s", "bytes/s"))
+    print("%12.0f %14.0f" % (messages / elapsed, messages * args.size / elapsed))
+    if samples:
+        print("%10s %10s %10s %10s %10s" % ("p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms"))
+        print("%10.3f %10.3f %10.3f %10.3f %10.3f" % tuple(percentile(samples, q) * 1e3
+                                                           for q in (0.5, 0.9, 0.99, 0.999, 1.0)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m websocket.loadgen", description="Websocket echo load generator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("-c", "--connections", type=int, default=100, help="connections to open (default 100)")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds to measure (default 10)")
+    parser.add_argument("-w", "--warmup", type=float, default=1.0, help="seconds to run before measuring (default 1)")
+    parser.add_argument("-s", "--size", type=int, default=64, help="message size in bytes (default 64)")
+    parser.add_argument("--window", type=int, default=1, help="messages in flight per connection (default 1)")
+    parser.add_argument("--text", action="store_true", help="send text messages instead of binary ones")
+    parser.add_argument("--concurrency", type=int, default=100, help="handshakes in progress at once (default 100)")
+    parser.add_argument("--serve", action="store_true", help="start an echo server on --host/--port in a child process")
+    args = parser.parse_args(argv)
+    raise_fd_limit(args.connections * (2 if args.serve else 1) + 256)
+    if args.serve:
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=serve, args=(args.host, args.port, ready), daemon=True)
+        server.start()
+        ready.wait()
+    aio.run(run(args))
+
+if __name__ == "__main__":
+    main()
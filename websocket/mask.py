@@ -0,0 +1,66 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Payload (un)masking, RFC 6455 section 5.3.
+# Masking is a XOR with the 4-byte key repeated over the payload, so the same routine both masks and unmasks.
+# Data is processed a block at a time: each block is read as one big integer and XORed with the key
+# repeated to the same length, which moves the per-byte loop from Python into C.
+# If NumPy is installed, large buffers are XORed as an array of 32-bit words instead.
+
+BLOCK_SIZE = 1 << 16 # must be a multiple of 4
+NUMPY_THRESHOLD = 1 << 10 # below this size the NumPy call overhead does not pay off
+
+_repeated_keys = {} # maskkey -> key repeated to BLOCK_SIZE bytes, as an integer
+
+def _repeated_key(maskkey):
+    value = _repeated_keys.get(maskkey)
+    if value is None:
+        if len(_repeated_keys) >= 256:
+            _repeated_keys.clear()
+        value = int.from_bytes(maskkey * (BLOCK_SIZE // 4), "little")
+        _repeated_keys[maskkey] = value
+    return value
+
+def _unmask_int(view, maskkey):
+    length = len(view)
+    start = 0
+    if length >= BLOCK_SIZE:
+        key = _repeated_key(maskkey)
+        while length - start >= BLOCK_SIZE:
+            block = view[start:start + BLOCK_SIZE]
+            block[:] = (int.from_bytes(block, "little") ^ key).to_bytes(BLOCK_SIZE, "little")
+            start += BLOCK_SIZE
+    remain = length - start
+    if remain > 0:
+        block = view[start:]
+        key = int.from_bytes((maskkey * (remain // 4 + 1))[:remain], "little")
+        block[:] = (int.from_bytes(block, "little") ^ key).to_bytes(remain, "little")
+
+def _unmask_numpy(view, maskkey):
+    array = numpy.frombuffer(view, dtype=numpy.uint8)
+    words = len(array) // 4
+    array[:words * 4].view(numpy.uint32)[:] ^= numpy.frombuffer(maskkey, dtype=numpy.uint32)[0]
+    for i in range(words * 4, len(array)):
+        array[i] ^= maskkey[i % 4]
+
+# XOR `buffer` (a writable bytes-like object) in place with the 4-byte `maskkey`.
+# `offset` is the position of buffer[0] within the whole payload, so a payload received in pieces
+# can be unmasked piece by piece: pass the number of payload bytes handled before this piece.
+def unmask(buffer, maskkey, offset=0):
+    view = memoryview(buffer).cast("B")
+    if len(view) == 0:
+        return
+    maskkey = bytes(maskkey)
+    if len(maskkey) != 4:
+        raise ValueError("mask key must be 4 bytes long")
+    shift = offset % 4
+    if shift:
+        maskkey = maskkey[shift:] + maskkey[:shift]
+    if numpy is not None and len(view) >= NUMPY_THRESHOLD:
+        _unmask_numpy(view, maskkey)
+    else:
+        _unmask_int(view, maskkey)
+
+mask = unmask
@@ -0,0 +1,119 @@
+import codecs
+
+from . import constants as c
+from .frame import ProtocolError
+
+# Reassembles data frames (a first frame, then continuation frames until FIN) into messages.
+# Control frames may be interleaved with the fragments of a message; they are handled by the caller
+# and never reach the assembler.
+#
+# feed() returns `(opcode, data, final)` or None, with opcode the one of the message's first frame:
+# - by default nothing is returned until the message is complete, then data is the whole message
+#   (str for text, bytes-like for binary) and final is True. Fragments are kept (copied only if they
+#   are views of the receive buffer) and joined with a single copy into a buffer preallocated to the
+#   message size. Payload buffers the parser took from its pool are given back once copied out.
+# - in streaming mode every frame or frame piece is handed out right away, so a large message never has
+#   to be held in memory: data is a str chunk for text (decoded incrementally) or a memoryview chunk for
+#   binary, valid only during the call, and final marks the last chunk.
+# Messages whose first frame has RSV1 set are decompressed with `deflate` (a DeflateSession, see deflate.py).
+# ProtocolError is raised for fragmentation errors, invalid UTF-8 text, and messages above max_message_size.
+class MessageAssembler:
+    __slots__ = ("_max_message_size", "_streaming", "_deflate", "_opcode", "_compressed", "_size", "_inflated",
+                 "_fragments", "_pooled", "_decoder")
+
+    def __init__(self, max_message_size=None, streaming=False, deflate=None):
+        self._max_message_size = max_message_size
+        self._streaming = streaming
+        self._deflate = deflate
+        self._opcode = None # opcode of the message in progress
+        self._compressed = False
+        self._size = 0
+        self._inflated = 0 # decompressed size of the message so far, when streaming a compressed one
+        self._fragments = []
+        self._pooled = [] # frames whose pooled payloads are in _fragments
+        self._decoder = None
+
+    def feed(self, frame):
+        opcode = frame.opcode
+        if opcode == c.OpcodeContinuation:
+            if self._opcode is None:
+                raise ProtocolError(c.CloseProtocolError, "continuation frame without a message to continue")
+        elif frame._payload_offset == 0:
+            if self._opcode is not None:
+                raise ProtocolError(c.CloseProtocolError, "new message before the previous one is finished")
+            self._opcode = opcode
+            self._compressed = bool(frame._flags_opcode & 0x40)
+            if self._compressed and self._deflate is None:
+                raise ProtocolError(c.CloseProtocolError, "compressed message without a negotiated extension")
+            if self._streaming and opcode == c.OpcodeText:
+                self._decoder = codecs.getincrementaldecoder("utf-8")()
+        payload = frame.payload
+        self._size += len(payload)
+        if self._max_message_size is not None and self._size > self._max_message_size:
+            raise ProtocolError(c.CloseMessageTooBig, "message exceeds the limit of %d bytes" % self._max_message_size)
+        final = frame.flag_fin and frame.payload_complete
+        opcode = self._opcode
+        if self._streaming:
+            if self._compressed:
+                payload = self._inflate(payload, final)
+            if self._decoder is not None:
+                payload = self._decode(payload, final)
+            if final:
+                self._reset()
+            return opcode, payload, final
+        if not final:
+            self._fragments.append(payload if frame._payload_owned else bytes(payload))
+            if frame._payload_pool is not None:
+                self._pooled.append(frame)
+            return None
+        if self._fragments:
+            self._fragments.append(payload)
+            data = bytearray(self._size)
+            view = memoryview(data)
+            pos = 0
+            for fragment in self._fragments:
+                view[pos:pos + len(fragment)] = fragment
+                pos += len(fragment)
+        elif frame._payload_owned and frame._payload_pool is None:
+            data = payload.obj
+        else:
+            # a view of the receive buffer or of a pooled buffer: decoded, decompressed or copied below
+            data = payload
+        if self._compressed:
+            data = self._deflate.decompress(data, True, self._max_message_size)
+        if opcode == c.OpcodeText:
+            try:
+                data = str(data, "utf-8")
+            except UnicodeDecodeError:
+                raise ProtocolError(c.CloseInvalidPayload, "text message is not valid UTF-8")
+        elif isinstance(data, memoryview):
+            data = bytes(data)
+        frame.release()
+        self._reset()
+        return opcode, data, True
+
+    def _inflate(self, payload, final):
+        budget = None
+        if self._max_message_size is not None:
+            budget = self._max_message_size - self._inflated
+        payload = self._deflate.decompress(payload, final, budget)
+        self._inflated += len(payload)
+        return payload
+
+    def _decode(self, payload, final):
+        try:
+            return self._decoder.decode(payload, final)
+        except UnicodeDecodeError:
+            raise ProtocolError(c.CloseInvalidPayload, "text message is not valid UTF-8")
+
+    def _reset(self):
+        self._opcode = None
+        self._compressed = False
+        self._size = 0
+        self._inflated = 0
+        self._fragments = []
+        if self._pooled:
+            for frame in self._pooled:
+                frame.release()
+            self._pooled = []
+        self._decoder = None
@@ -0,0 +1,179 @@
+import bisect
+
+from . import constants as c
+
+# Server metrics: counters, gauges and histograms updated by the reactor, read through snapshot() or
+# dumped in the Prometheus text format. A server only pays for them when it is given a Metrics object,
+# every hook is behind a single `is not None` test otherwise.
+#
+#     metrics = Metrics(per_session=True)
+#     server = WebsocketServer(metrics=metrics)
+#     ...
+#     print(metrics.prometheus())
+#
+# Counters are updated without locking: send() and broadcast() called from other threads count their frames
+# on those threads, so outbound frame counts are approximate then. With `trace`, trace(event, session, *info)
+# is called on every event: ("handshake", status), ("frame_in", opcode, length), ("frame_out", opcode, length)
+# and ("close", reason).
+
+OPCODE_NAMES = {c.OpcodeContinuation: "continuation", c.OpcodeText: "text", c.OpcodeBinary: "binary",
+                c.OpcodeClose: "close", c.OpcodePing: "ping", c.OpcodePong: "pong"}
+
+# Bucket upper bounds of the histograms.
+TIME_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # per bucket, the last one is above every bound
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Value below which `q` (0..1) of the observations fall, as the upper bound of its bucket.
+    def quantile(self, q):
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {"buckets": dict(zip(self.bounds + (float("inf"),), self.counts)), "sum": self.sum, "count": self.count}
+
+# Counters of one session, kept when the Metrics are created with per_session=True.
+class SessionMetrics:
+    __slots__ = ("frames_in", "frames_out", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def snapshot(self):
+        return {"frames_in": self.frames_in, "frames_out": self.frames_out,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+class Metrics:
+    # per_session: also count frames and bytes of every session (see WebsocketSession.metrics)
+    # trace: optional callable, called with every event (see above)
+    def __init__(self, per_session=False, trace=None):
+        self.per_session = per_session
+        self.trace = trace
+        self.handshakes = {} # response status (or "timeout") -> count
+        self.closes = {} # close code sent, or reason the connection was dropped -> count
+        self.frames_in = {} # opcode name -> count
+        self.frames_out = {}
+        self.payload_in = {} # opcode name -> payload bytes
+        self.payload_out = {}
+        self.bytes_in = 0 # bytes received from / written to the sockets
+        self.bytes_out = 0
+        self.loop_time = Histogram(TIME_BUCKETS) # busy time of every event loop iteration
+        self.callback_time = Histogram(TIME_BUCKETS) # time spent in application callbacks
+        self.queue_depth = Histogram(SIZE_BUCKETS) # send queue size of a session after queuing data
+        self.gauges = {} # name -> (help text, callable returning the current value), set up by the server
+
+    # hooks, called by the server
+
+    def handshake(self, sess, status):
+        self.handshakes[status] = self.handshakes.get(status, 0) + 1
+        if self.trace is not None:
+            self.trace("handshake", sess, status)
+
+    def close(self, sess, reason):
+        self.closes[reason] = self.closes.get(reason, 0) + 1
+        if self.trace is not None:
+            self.trace("close", sess, reason)
+
+    def frame_in(self, sess, opcode, length):
+        name = OPCODE_NAMES[opcode]
+        self.frames_in[name] = self.frames_in.get(name, 0) + 1
+        self.payload_in[name] = self.payload_in.get(name, 0) + length
+        if sess._metrics is not None:
+            sess._metrics.frames_in += 1
+        if self.trace is not None:
+            self.trace("frame_in", sess, opcode, length)
+
+    def frame_out(self, sess, opcode, length):
+        name = OPCODE_NAMES[opcode]
+        self.frames_out[name] = self.frames_out.get(name, 0) + 1
+        self.payload_out[name] = self.payload_out.get(name, 0) + length
+        if sess._metrics is not None:
+            sess._metrics.frames_out += 1
+        if self.trace is not None:
+            self.trace("frame_out", sess, opcode, length)
+
+    def received(self, sess, nbytes):
+        self.bytes_in += nbytes
+        if sess._metrics is not None:
+            sess._metrics.bytes_in += nbytes
+
+    def sent(self, sess, nbytes):
+        self.bytes_out += nbytes
+        if sess._metrics is not None:
+            sess._metrics.bytes_out += nbytes
+
+    # reading
+
+    def snapshot(self):
+        return {
+            "handshakes": dict(self.handshakes),
+            "closes": dict(self.closes),
+            "frames_in": dict(self.frames_in),
+            "frames_out": dict(self.frames_out),
+            "payload_in": dict(self.payload_in),
+            "payload_out": dict(self.payload_out),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "loop_time": self.loop_time.snapshot(),
+            "callback_time": self.callback_time.snapshot(),
+            "queue_depth": self.queue_depth.snapshot(),
+            "gauges": {name: gauge() for name, (_, gauge) in self.gauges.items()},
+        }
+
+    # The metrics in the Prometheus text exposition format.
+    def prometheus(self, prefix="websocket"):
+        lines = []
+        def header(name, kind, text):
+            lines.append("# HELP %s_%s %s" % (prefix, name, text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+        def labelled(name, label, values, text):
+            header(name, "counter", text)
+            for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+                lines.append('%s_%s{%s="%s"} %s' % (prefix, name, label, key, value))
+        def histogram(name, hist, text):
+            header(name, "histogram", text)
+            total = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                total += count
+                lines.append('%s_%s_bucket{le="%g"} %d' % (prefix, name, bound, total))
+            lines.append('%s_%s_bucket{le="+Inf"} %d' % (prefix, name, hist.count))
+            lines.append("%s_%s_sum %r" % (prefix, name, hist.sum))
+            lines.append("%s_%s_count %d" % (prefix, name, hist.count))
+        labelled("handshakes_total", "status", self.handshakes, "Upgrade requests answered, by response status.")
+        labelled("closes_total", "reason", self.closes, "Connections closed, by close code sent or reason dropped.")
+        labelled("frames_received_total", "opcode", self.frames_in, "Frames received, by opcode.")
+        labelled("frames_sent_total", "opcode", self.frames_out, "Frames sent, by opcode.")
+        labelled("payload_received_bytes_total", "opcode", self.payload_in, "Payload bytes received, by opcode.")
+        labelled("payload_sent_bytes_total", "opcode", self.payload_out, "Payload bytes sent, by opcode.")
+        header("received_bytes_total", "counter", "Bytes received from the sockets.")
+        lines.append("%s_received_bytes_total %d" % (prefix, self.bytes_in))
+        header("sent_bytes_total", "counter", "Bytes written to the sockets.")
+        lines.append("%s_sent_bytes_total %d" % (prefix, self.bytes_out))
+        histogram("loop_seconds", self.loop_time, "Busy time of the event loop iterations.")
+        histogram("callback_seconds", self.callback_time, "Time spent in application callbacks.")
+        histogram("send_queue_bytes", self.queue_depth, "Send queue size of a session after queuing data.")
+        for name, (text, gauge) in self.gauges.items():
+            header(name, "gauge", text)
+            lines.append("%s_%s %s" % (prefix, name, gauge()))
+        return "\n".join(lines) + "\n"
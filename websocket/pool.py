@@ -0,0 +1,40 @@
+# Size-classed pool of bytearrays, for receive buffers and frame payloads.
+# Sizes are rounded up to a power of two between min_size and max_size, and each class keeps at most
+# `max_buffers` free buffers, so the pool never holds more than that many idle buffers of each class.
+# Larger requests are allocated at their exact size and are not taken back.
+# A pool is not thread-safe: each event loop has its own.
+class BufferPool:
+    __slots__ = ("min_size", "max_size", "max_buffers", "_min_bits", "_free")
+
+    def __init__(self, min_size=1024, max_size=65536, max_buffers=256):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_buffers = max_buffers
+        self._min_bits = (min_size - 1).bit_length()
+        # free buffers by size class, class i holds buffers of min_size << i bytes
+        self._free = [[] for _ in range((max_size - 1).bit_length() - self._min_bits + 1)]
+
+    # A buffer of at least `size` bytes; its content is undefined.
+    def acquire(self, size):
+        if size > self.max_size:
+            return bytearray(size)
+        index = max(0, (size - 1).bit_length() - self._min_bits)
+        free = self._free[index]
+        if free:
+            return free.pop()
+        return bytearray(self.min_size << index)
+
+    # Give a buffer back once nothing refers to its content anymore.
+    def release(self, buffer):
+        size = len(buffer)
+        if size > self.max_size or size < self.min_size or size & (size - 1):
+            return
+        free = self._free[(size - 1).bit_length() - self._min_bits]
+        if len(free) < self.max_buffers:
+            free.append(buffer)
+
+    # Number of free buffers and bytes held by the pool.
+    def stats(self):
+        count = sum(map(len, self._free))
+        size = sum(len(free) * (self.min_size << index) for index, free in enumerate(self._free))
+        return count, size
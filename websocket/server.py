@@ -1,259 +1,862 @@
-import socket, threading, select, re, hashlib, base64, multiprocessing
-
-from . import constants as c
-from .frame import WebsocketFrame
-import socketio as io
-
-class WebsocketSession:
-    def __init__(self, sock=None, address=None, buffer_size=1024):
-        self._sock = sock
-        self._address = address
-        self._dirty_data = b""
-        self._recving_frame = None
-        self._reset()
-    def _reset(self):
-        self._state = c.StateUnconnected
-        self._reqline = None
-        self._headers = {}
-    def _complete_frame(self):
-        # TODO: assemble the frame or emit an event
-        self._recving_frame = None
-    @property
-    def state(self):
-        return self._state
-    def close(self):
-        self._sock.shutdown(socket.SHUT_RDWR)
-        self._sock.close()
-        self._state = c.StateClosed
-
-class WebsocketServer:
-    # buffer_size: maximum buffer size for receiving HTTP headers
-    def __init__(self, buffer_size=1024):
-        self._address = None
-        self._port = None
-        self._socket = None
-        self._thread = None
-        self._pipefd1 = None # self-pipe trick
-        self._pipefd2 = None # self-pipe trick
-        self._sessions = []
-        self._buffer_size = buffer_size
-    def listen(self, address="0.0.0.0", port=8080):
-        self._address = address
-        self._port = port
-        self._socket = socket.socket()
-        self._socket.bind((self._address, self._port))
-        self._socket.listen(1)
-        self._pipefd1, self._pipefd2 = multiprocessing.Pipe()
-        self._thread = threading.Thread(target=self._threadfn)
-        self._thread.start()
-    def close(self):
-        self._pipefd1.send("terminate")
-        self._thread.join()
-        for sess in self._sessions:
-            sess.close()
-        self._socket.close()
-
-    @property
-    def sessions(self):
-        return [sess for sess in self._sessions]
-    
-    def _remove_session(self, sess):
-        sess.close()
-        self._sessions.remove(sess)
-
-    def _threadfn(self):
-        stopped = False
-        while not stopped:
-            srlist = [self._pipefd2, self._socket] + [sess._sock for sess in self._sessions]
-            swlist = []
-            rlist, _, _ = select.select(srlist, swlist, srlist + swlist, 1)
-            for item in rlist:
-                if item == self._pipefd2:
-                    # self-pipe
-                    stopped = True
-                    break
-                elif item == self._socket:
-                    # a client is requesting for connecting
-                    sock, addr = item.accept()
-                    sock.setblocking(0)
-                    sess = WebsocketSession(sock, addr)
-                    sess._state = c.StateUnconnected
-                    self._sessions.append(sess)
-                else:
-                    # a client has sent some data to us
-                    sess = list(filter(lambda x: x._sock == item, self._sessions))
-                    if len(sess) == 0: continue
-                    sess = sess[0]
-                    # If we are in Unconnected State, we attempt to parse the first line as a HTTP request line.
-                    # HTTP request line format:
-                    #     <method> <url> HTTP/<version>
-                    # Note that method must be 'GET'.
-                    # Note that this loop will be executed at most once (we just use `while` to substitute `if` for convenient flow-control).
-                    # If we enter this block and exit from this state, _dirty_data should be cleared at the time we exit.
-                    recved_bytes = 0
-                    while sess._state == c.StateUnconnected:
-                        line = io.recv_line(sess._sock, self._buffer_size, _dirty_data=sess._dirty_data)
-                        recved_bytes += len(line) - len(sess._dirty_data)
-                        if io.error == io.e.ErrorBufferOverflow:
-                            sess._dirty_data = line
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        elif io.error == io.e.ErrorStreamEmpty:
-                            sess._dirty_data = line
-                            break
-                        sess._dirty_data = sess._dirty_data[len(line):]
-                        try:
-                            line = line.decode("ascii")
-                        except UnicodeError:
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        line = re.split(r"\s+", line.strip())
-                        if len(line) < 3:
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        if line[0].upper() != "GET":
-                            sess._sock.send("HTTP/1.1 405 Method Not Allowed\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        sess._state = c.StateConnecting
-                        break
-                    # If we are in Connecting State, we attempt to parse each line as a HTTP header line until an empty line is met.
-                    # If we enter this block and exit from this state, _dirty_data should be cleared at the time we exit.
-                    while sess._state == c.StateConnecting:
-                        line = io.recv_line(sess._sock, self._buffer_size, _dirty_data=sess._dirty_data)
-                        recved_bytes += len(line) - len(sess._dirty_data)
-                        if io.error == io.e.ErrorBufferOverflow:
-                            sess._dirty_data = line
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        elif io.error == io.e.ErrorStreamEmpty:
-                            sess._dirty_data = line
-                            break
-                        sess._dirty_data = sess._dirty_data[len(line):]
-                        try:
-                            line = line.decode("ascii")
-                        except UnicodeError:
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        line = line.strip()
-                        if len(line) == 0:
-                            # header is finished here, we have to determine if it is a valid websocket request,
-                            # then response properly and establish the connection.
-                            if "Connection" in sess._headers and sess._headers["Connection"].lower().strip() == "upgrade" \
-                                    and "Upgrade" in sess._headers and sess._headers["Upgrade"].lower().strip() == "websocket" \
-                                    and "Sec-WebSocket-Version" in sess._headers \
-                                    and "Sec-WebSocket-Key" in sess._headers:
-                                seckey = sess._headers["Sec-WebSocket-Key"]
-                                secaccept = hashlib.sha1()
-                                secaccept.update(seckey.encode("ascii") + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11")
-                                secaccept = base64.b64encode(secaccept.digest())
-                                sendstr = "HTTP/1.1 101 Switching Protocols\r\n"
-                                sendstr += "Connection: Upgrade\r\n"
-                                sendstr += "Upgrade: websocket\r\n"
-                                sendstr += "Sec-WebSocket-Accept: " + secaccept + "\r\n"
-                                sendstr += "\r\n"
-                                sess._sock.send(sendstr)
-                                sess._state = c.StateConnected
-                            else:
-                                sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                                sess.close()
-                                self._sessions.remove(sess)
-                            break
-                        colonidx = line.find(":")
-                        if colonidx <= 0:
-                            sess._sock.send("HTTP/1.1 400 Bad Request\r\n\r\n")
-                            sess.close()
-                            self._sessions.remove(sess)
-                            break
-                        header_key = line[:colonidx].strip()
-                        header_value = line[colonidx+1:].strip()
-                        sess._headers[header_key] = header_value
-                        break
-                    # If we are in Connected State, we parse data with websocket protocol.
-                    # Note that this loop will be executed at most once (we just use `while` to substitute `if` for convenient flow-control).
-                    while sess._state == c.StateConnected:
-                        # if recving_frame is not present, create a new frame
-                        if sess._recving_frame is None:
-                            sess._recving_frame = WebsocketFrame()
-                        frame = sess._recving_frame
-                        # Get frame header fields.
-                        # For each field, after the time that we have read all its bytes, _dirty_data should be empty.
-                        if frame._field_flags_opcode is None:
-                            data = io.recv_bytes(sess._sock, 1, _dirty_data=sess._dirty_data)
-                            recved_bytes += len(data) - len(sess._dirty_data)
-                            if io.error == io.e.ErrorStreamEmpty:
-                                sess._dirty_data = data
-                                break
-                            sess._dirty_data = sess._dirty_data[len(data):]
-                            frame._field_flags_opcode = data
-                        if frame._field_mask_len is None:
-                            data = io.recv_bytes(sess._sock, 1, _dirty_data=sess._dirty_data)
-                            recved_bytes += len(data) - len(sess._dirty_data)
-                            if io.error == io.e.ErrorStreamEmpty:
-                                sess._dirty_data = data
-                                break
-                            sess._dirty_data = sess._dirty_data[len(data):]
-                            frame._field_mask_len = data
-                        if frame.payload_length is None and frame._field_len2 is None:
-                            data = io.recv_bytes(sess._sock, 2, _dirty_data=sess._dirty_data)
-                            recved_bytes += len(data) - len(sess._dirty_data)
-                            if io.error == io.e.ErrorStreamEmpty:
-                                sess._dirty_data = data
-                                break
-                            sess._dirty_data = sess._dirty_data[len(data):]
-                            frame._field_len2 = data
-                        if frame.payload_length is None and frame._field_len6 is None:
-                            data = io.recv_bytes(sess._sock, 6, _dirty_data=sess._dirty_data)
-                            recved_bytes += len(data) - len(sess._dirty_data)
-                            if io.error == io.e.ErrorStreamEmpty:
-                                sess._dirty_data = data
-                                break
-                            sess._dirty_data = sess._dirty_data[len(data):]
-                            frame._field_len6 = data
-                        if frame.flag_mask and frame._field_maskkey is None:
-                            data = io.recv_bytes(sess._sock, 4, _dirty_data=sess._dirty_data)
-                            recved_bytes += len(data) - len(sess._dirty_data)
-                            if io.error == io.e.ErrorStreamEmpty:
-                                sess._dirty_data = data
-                                break
-                            sess._dirty_data = sess._dirty_data[len(data):]
-                            frame._field_maskkey = data
-                        # get frame data
-                        if frame._payload_buffer is None:
-                            frame._payload_buffer = bytearray(frame.playload_length)
-                            frame._payload_bytesrecved = 0
-                        if len(sess._dirty_data) > 0:
-                            cp_start = frame._payload_bytesrecved
-                            cp_end = max(frame._payload_bytesrecved + len(sess._dirty_data), len(frame._payload_buffer))
-                            cp_len = cp_end - cp_start
-                            memoryview(frame._payload_buffer)[cp_start:cp_end] = sess._dirty_data[:cp_len]
-                            sess._dirty_data = sess._dirty_data[cp_len:]
-                            frame._payload_bytesrecved = cp_end
-                        if frame._payload_bytesrecved < len(frame._payload_buffer):
-                            cp_len = len(frame._payload_buffer) - frame._payload_bytesrecved
-                            recved_bytes += sess._sock.recv_into(memoryview(frame._payload_buffer)[frame._payload_bytesrecved:], cp_len)
-                        if frame._payload_bytesrecved == len(frame._payload_buffer):
-                            sess._complete_frame()
-                        break
-                    # All jobs for this client event are done.
-                    # If no bytes are received during handling this event, the socket should be closed.
-                    if recved_bytes == 0:
-                        sess.close()
-                        self._sessions.remove(sess)
-
-
-
-
-
-
+import socket, threading, selectors, multiprocessing, collections, time, functools, traceback
+import concurrent.futures
+
+from . import constants as c
+from .frame import FrameParser, ProtocolError, encode_header, encode_header_into, header_size
+from .message import MessageAssembler
+from .timers import TimerWheel
+from .pool import BufferPool
+from .metrics import SessionMetrics
+from . import socketio as io
+from . import handshake
+
+# Sessions are kept small, as a server may hold tens of thousands of mostly idle ones: the receive buffer
+# only holds memory while data is pending (see RecvBuffer), and everything else is created on first use.
+class WebsocketSession:
+    __slots__ = ("_sock", "_fileno", "_address", "_server", "_recvbuf", "_parser", "_assembler", "_deflate",
+                 "_sendqueue", "_handed_off", "_handed_queued", "_writing_paused", "_flush_scheduled", "_cork_deadline", "_close_requested", "_close_received", "_groups", "_timer",
+                 "_last_recv", "_last_message", "_ping_sent", "_metrics", "_handlers", "_handler_busy", "_reading_paused",
+                 "_state", "_reqline", "_headers")
+
+    # pool: BufferPool the receive buffer (and the send queue's packing buffer) is taken from
+    def __init__(self, sock=None, address=None, pool=None):
+        self._sock = sock
+        self._fileno = sock.fileno() if sock is not None else None
+        self._address = address
+        self._server = None
+        self._recvbuf = io.RecvBuffer(pool=pool)
+        self._parser = None # set up by the server once the handshake is done, according to its limits
+        self._assembler = None
+        self._deflate = None # DeflateSession, if permessage-deflate was negotiated
+        self._sendqueue = io.SendQueue(pool)
+        # bytes sent from other threads, and how many of them the reactor has queued (or dropped) since:
+        # the difference counts against the high-water mark
+        self._handed_off = 0
+        self._handed_queued = 0
+        self._writing_paused = False
+        self._flush_scheduled = False
+        self._cork_deadline = None # loop time the corked send queue is due to be written out
+        self._close_requested = False
+        self._close_received = False # whether the client's close frame has arrived
+        self._groups = None # names of the groups the session belongs to, a set once it joins one
+        self._timer = None # the one pending deadline of the session (handshake, keepalive or close)
+        self._last_recv = 0 # loop time of the last data received
+        self._last_message = 0 # loop time of the last message (or chunk) delivered
+        self._ping_sent = None # loop time of the keepalive ping awaiting an answer
+        self._metrics = None # SessionMetrics, if the server keeps per-session metrics
+        self._handlers = None # deque of callbacks waiting for the executor, in order
+        self._handler_busy = False # whether a callback of the session is running on the executor
+        self._reading_paused = False # while too many callbacks are waiting
+        self._reset()
+    def _reset(self):
+        self._state = c.StateUnconnected
+        self._reqline = None
+        self._headers = {}
+    # Handle a frame (or, when streaming, a frame piece) received from the client.
+    # Raises ProtocolError if the client violates the protocol.
+    def _complete_frame(self, frame):
+        if not frame.flag_mask:
+            raise ProtocolError(c.CloseProtocolError, "client frames must be masked")
+        opcode = frame.opcode
+        if self._state != c.StateConnected and opcode != c.OpcodeClose:
+            # closing: only the client's close frame matters now
+            frame.release()
+            return
+        rsv = frame._flags_opcode & 0x70
+        if rsv and (rsv != 0x40 or self._deflate is None or opcode not in (c.OpcodeText, c.OpcodeBinary)):
+            raise ProtocolError(c.CloseProtocolError, "reserved bits set without a negotiated extension")
+        if opcode == c.OpcodePing:
+            # the payload may point into the receive buffer, while the pong may have to wait in the send queue
+            self._server._send_frame(self, c.OpcodePong, bytes(frame.payload))
+            frame.release()
+        elif opcode == c.OpcodeClose:
+            code = c.CloseNoStatus
+            if frame.payload_length == 1:
+                raise ProtocolError(c.CloseProtocolError, "close frame with a 1-byte payload")
+            elif frame.payload_length >= 2:
+                code = int.from_bytes(frame.payload[:2], "big")
+            frame.release()
+            self._close_received = True
+            self._server._close_handshake(self, c.CloseNormal if code == c.CloseNoStatus else code)
+        elif opcode == c.OpcodePong:
+            frame.release()
+        else:
+            message = self._assembler.feed(frame)
+            if message is not None:
+                self._server._deliver(self, *message)
+    @property
+    def state(self):
+        return self._state
+    # Whether the session's send queue is below the server's high-water mark.
+    @property
+    def writable(self):
+        return not self._writing_paused
+    # Queue a message (str as a text frame, bytes-like as a binary one) for sending. It may be called
+    # from any thread: other threads hand the frame over to the reactor, which queues and writes it.
+    # The data is not copied, so it must not be modified afterwards.
+    # Returns False if the message was dropped by the server's overflow policy.
+    def send(self, data):
+        if self._state != c.StateConnected:
+            return False
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+            opcode = c.OpcodeText
+        else:
+            opcode = c.OpcodeBinary
+        return self._server._send_message(self, opcode, data)
+    # Frame and byte counters of the session, if the server keeps per-session metrics (see metrics.py).
+    @property
+    def metrics(self):
+        return self._metrics.snapshot() if self._metrics is not None else None
+    # Close the session: a connected session starts the closing handshake with status `code`, and the connection
+    # is closed once the client answers (or close_timeout expires); a session still in its upgrade is dropped.
+    # It may be called from any thread; frames sent before from the same thread go out before the close frame.
+    def close(self, code=c.CloseNormal):
+        if self._server is None:
+            self._close()
+        else:
+            self._server._close_session(self, code)
+    # Close the socket right away.
+    def _close(self):
+        if self._state == c.StateClosed:
+            return
+        self._sendqueue.clear()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # the peer is already gone
+            pass
+        self._sock.close()
+        self._state = c.StateClosed
+
+class WebsocketServer:
+    PACK_SIZE = 1024 # when corking, payloads up to this size are copied into the packing buffer
+    # buffer_size: maximum size of the HTTP request header block, larger ones are refused with 431
+    # handshake_timeout: seconds a client gets to complete its upgrade request before it is disconnected
+    # ping_interval: a ping is sent to sessions from which nothing has been received for that many seconds
+    # ping_timeout: sessions that do not send anything within that many seconds after a ping are dropped
+    # idle_timeout: sessions that have not sent a message for that many seconds are closed (status 1001);
+    #     pings and pongs do not count
+    # close_timeout: seconds the closing handshake may take: for the server's close frame to be written out, and,
+    #     when the server started it, for the client's close frame to arrive
+    #     Any of these timeouts may be None to disable it.
+    # metrics: a Metrics object to collect counters and histograms in (metrics.py), None to disable them
+    # max_frame_size, max_message_size: limits, in bytes, of received frames and (reassembled) messages,
+    #     beyond which a session is closed with status 1009; None for no limit
+    # on_message(session, message): called for every complete message (str for text, bytes-like for binary)
+    # on_message_chunk(session, chunk, final): if given, messages are streamed instead: called for every piece of
+    #     payload as it arrives (str for text, a memoryview only valid during the call for binary), final marks
+    #     the last piece of a message. Only max_message_size applies then, frames are never buffered whole.
+    # on_connect(session): called once the handshake is done
+    # on_close(session): called once a session that had connected is gone
+    # executor: where the callbacks above run:
+    #     None runs them on the reactor thread, so they must not block;
+    #     a ThreadPoolExecutor runs them on its threads (chunks are then copied, as their memory is reused);
+    #     a ProcessPoolExecutor runs them in its processes, for CPU-heavy work: they are then called with the
+    #         session's address instead of the session, so they must be picklable module-level functions, and
+    #         whatever on_connect, on_message or on_message_chunk returns (other than None) is sent back as a reply.
+    #     The callbacks of a session always run one at a time and in order; replies and sends from other threads
+    #     reach the reactor through its self-pipe. An exception closes the session with status 1011.
+    # max_pending: callbacks of a session that may wait for the executor before reading from it is paused
+    # deflate: a PerMessageDeflate to offer permessage-deflate compression (deflate.py), None to disable it
+    # write_limits: (high, low) water marks, in bytes, of every session's send queue
+    # nodelay: set TCP_NODELAY on the sessions' sockets, so that small frames are not held back by Nagle's algorithm
+    # cork: coalesce writes: frames queued on the reactor thread (replies from inline callbacks, pongs, ...) are
+    #     not written right away but at the end of the loop iteration, with one syscall per session; the headers
+    #     and small payloads are packed into a shared buffer of the send queue instead of one buffer each
+    # cork_delay: with cork, seconds queued frames may wait for more to join them before they are written (a
+    #     Nagle-style policy for high rates of tiny messages); None writes them at the end of every iteration
+    # cork_size: with cork, queued bytes beyond which a send queue is written out right away
+    # overflow_policy: what happens when a message would take a send queue above the high-water mark:
+    #     "pause" queues it anyway and calls on_pause_writing(session), then on_resume_writing(session)
+    #         once the queue has drained below the low-water mark;
+    #     "drop" discards the message;
+    #     "close" closes the session.
+    def __init__(self, buffer_size=8192, handshake_timeout=10.0, ping_interval=30.0, ping_timeout=10.0,
+                 idle_timeout=None, close_timeout=5.0, max_frame_size=1 << 24, max_message_size=1 << 26,
+                 on_message=None, on_message_chunk=None, deflate=None,
+                 write_limits=(1 << 20, 1 << 18), overflow_policy="pause",
+                 on_pause_writing=None, on_resume_writing=None, metrics=None,
+                 on_connect=None, on_close=None, executor=None, max_pending=64,
+                 nodelay=True, cork=False, cork_delay=None, cork_size=16384):
+        if overflow_policy not in ("pause", "drop", "close"):
+            raise ValueError("unknown overflow policy <%s>" % overflow_policy)
+        self._address = None
+        self._port = None
+        self._socket = None
+        self._thread = None
+        self._pipefd1 = None # self-pipe trick
+        self._pipefd2 = None # self-pipe trick
+        self._selector = None
+        self._sessions = {} # fileno -> WebsocketSession
+        self._writers = set() # filenos of sessions registered for EVENT_WRITE
+        self._buffer_size = buffer_size
+        self._handshake_timeout = handshake_timeout
+        self._ping_interval = ping_interval
+        self._ping_timeout = ping_timeout
+        self._idle_timeout = idle_timeout
+        self._close_timeout = close_timeout
+        self._timers = TimerWheel() # only used by the reactor thread
+        self._now = time.monotonic() # loop time, updated after every poll
+        self._max_frame_size = max_frame_size
+        self._max_message_size = max_message_size
+        self._on_message = on_message
+        self._on_message_chunk = on_message_chunk
+        self._deflate = deflate
+        self._write_high, self._write_low = write_limits
+        self._overflow_policy = overflow_policy
+        self._on_pause_writing = on_pause_writing
+        self._on_resume_writing = on_resume_writing
+        self._on_connect = on_connect
+        self._on_close = on_close
+        self._executor = executor
+        self._process_executor = isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+        self._max_pending = max_pending
+        self._handlers_done = collections.deque() # (session, future) of callbacks finished on the executor
+        self._handlers_notified = False # whether a "handlers" is on its way through the self-pipe
+        self._thread_ident = None
+        self._flush_requests = collections.deque() # sessions to write out (or close) once the self-pipe is read
+        self._flush_notified = False # whether a "flush" is on its way through the self-pipe
+        self._close_requests = collections.deque() # (session, code) closed by other threads, see _close_session
+        self._nodelay = nodelay
+        self._cork = cork
+        self._cork_delay = cork_delay or 0
+        self._cork_size = cork_size
+        self._corked = collections.deque() # (deadline, session) of the corked send queues, by deadline
+        self._handoffs = collections.deque() # (session, buffers, message, size) sent from other threads, see _hand_off
+        # held by other threads while they admit and hand over data, so that each session's _handed_off count
+        # stays exact with several senders; reentrant, as on_pause_writing may send too
+        self._handoff_lock = threading.RLock()
+        self._groups = {} # group name -> set of WebsocketSession
+        self._pool = BufferPool() # receive and payload buffers, only used by the reactor thread
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.gauges["sessions"] = ("Open sessions.", lambda: len(self._sessions))
+            metrics.gauges["queued_bytes"] = ("Bytes waiting in the send queues.",
+                                              lambda: sum(len(sess._sendqueue) for sess in self.sessions))
+            metrics.gauges["pool_free_bytes"] = ("Bytes of free buffers in the buffer pool.", lambda: self._pool.stats()[1])
+    # backlog: length of the kernel's queue of pending connections
+    # reuse_port: set SO_REUSEPORT, so that several processes can listen on the same port (see workers.py)
+    def listen(self, address="0.0.0.0", port=8080, backlog=128, reuse_port=False):
+        self._address = address
+        self._port = port
+        self._socket = socket.socket()
+        if reuse_port:
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._socket.bind((self._address, self._port))
+        self._socket.listen(backlog)
+        self._socket.setblocking(0)
+        self._pipefd1, self._pipefd2 = multiprocessing.Pipe()
+        # Registrations are persistent: the listener and the self-pipe are registered once here,
+        # and each session is registered once when it is accepted, with the session itself as the key data.
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._pipefd2, selectors.EVENT_READ)
+        self._selector.register(self._socket, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._threadfn)
+        self._thread.start()
+    # Stop accepting new connections, while the established sessions keep being served. Calling it again does nothing.
+    def drain(self):
+        self._pipefd1.send("drain")
+    def close(self):
+        self._pipefd1.send("terminate")
+        self._thread.join()
+        for sess in list(self._sessions.values()):
+            sess._close()
+        self._sessions.clear()
+        self._selector.close()
+        self._socket.close()
+
+    @property
+    def sessions(self):
+        return list(self._sessions.values())
+
+    # Session groups (rooms) to broadcast to. A session leaves all its groups when it is removed.
+    def join(self, sess, group):
+        self._groups.setdefault(group, set()).add(sess)
+        if sess._groups is None:
+            sess._groups = set()
+        sess._groups.add(group)
+    def leave(self, sess, group):
+        members = self._groups.get(group)
+        if members is not None:
+            members.discard(sess)
+            if not members:
+                del self._groups[group]
+        if sess._groups is not None:
+            sess._groups.discard(group)
+    def group(self, group):
+        return list(self._groups.get(group, ()))
+
+    # Send the same message to many sessions: all connected sessions, the members of a group (given by name),
+    # or an iterable of sessions. The frame is encoded once, and every send queue holds a view of that one buffer.
+    # Sessions using permessage-deflate share a compressed frame when they carry no context over between messages,
+    # otherwise each compresses the message with its own context (on the reactor thread, see _send_message).
+    # Returns the number of sessions the message was queued for.
+    def broadcast(self, data, sessions=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+            opcode = c.OpcodeText
+        else:
+            opcode = c.OpcodeBinary
+        if sessions is None:
+            sessions = list(self._sessions.values())
+        elif isinstance(sessions, str):
+            sessions = list(self._groups.get(sessions, ()))
+        if threading.get_ident() != self._thread_ident:
+            # the handoff lock is taken once for all the sessions, rather than once per session
+            with self._handoff_lock:
+                return self._broadcast(opcode, data, sessions, True)
+        return self._broadcast(opcode, data, sessions, False)
+
+    def _broadcast(self, opcode, data, sessions, handing_off):
+        frame = memoryview(encode_header(opcode, len(data)) + data)
+        plain = ((frame,), len(data))
+        compressed = {} # DeflateSession.shared_key -> frame compressed once for all those sessions, payload length
+        count = 0
+        for sess in sessions:
+            if sess._state != c.StateConnected:
+                continue
+            buffers, length = plain
+            deflate = sess._deflate
+            if deflate is not None and len(data) >= deflate.threshold:
+                key = deflate.shared_key
+                if key is None:
+                    if handing_off:
+                        queued = self._hand_off(sess, None, (opcode, data), len(data))
+                    else:
+                        queued = self._send_message(sess, opcode, data)
+                    if queued:
+                        count += 1
+                    continue
+                if key not in compressed:
+                    payload = deflate.compress(data)
+                    compressed[key] = (memoryview(encode_header(opcode, len(payload), rsv1=True) + payload),), len(payload)
+                buffers, length = compressed[key]
+            if handing_off:
+                queued = self._hand_off(sess, buffers, None, len(buffers[0]))
+            else:
+                queued = self._enqueue(sess, buffers)
+            if queued:
+                count += 1
+                if self._metrics is not None:
+                    self._metrics.frame_out(sess, opcode, length)
+        return count
+
+    def _add_session(self, sess):
+        sess._server = self
+        self._sessions[sess._fileno] = sess
+        self._selector.register(sess._sock, selectors.EVENT_READ, sess)
+
+    def _remove_session(self, sess):
+        # The socket has to be unregistered before it is closed, as closing it invalidates its fileno.
+        if self._sessions.pop(sess._fileno, None) is not None:
+            if sess._fileno in self._selector.get_map():
+                self._selector.unregister(sess._sock)
+            self._writers.discard(sess._fileno)
+            for group in list(sess._groups or ()):
+                self.leave(sess, group)
+        if sess._timer is not None:
+            self._timers.cancel(sess._timer)
+            sess._timer = None
+        connected = sess._state in (c.StateConnected, c.StageClosing)
+        sess._close()
+        if connected and self._on_close is not None:
+            self._dispatch(sess, self._on_close)
+
+    # Register the session's socket for the events it currently needs: reading unless it is paused,
+    # writing while its send queue could not be written out.
+    def _update_events(self, sess):
+        events = (0 if sess._reading_paused else selectors.EVENT_READ) \
+               | (selectors.EVENT_WRITE if sess._fileno in self._writers else 0)
+        registered = sess._fileno in self._selector.get_map()
+        if events == 0:
+            if registered:
+                self._selector.unregister(sess._sock)
+        elif registered:
+            self._selector.modify(sess._sock, events, sess)
+        else:
+            self._selector.register(sess._sock, events, sess)
+
+    def _accept(self):
+        # Drain the accept queue, as the listener is non-blocking and several clients may be pending.
+        # The listener may have been closed by drain() earlier in the same batch of events.
+        while self._socket.fileno() >= 0:
+            try:
+                sock, addr = self._socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(0)
+            if self._nodelay:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sess = WebsocketSession(sock, addr, self._pool)
+            sess._state = c.StateUnconnected
+            if self._metrics is not None and self._metrics.per_session:
+                sess._metrics = SessionMetrics()
+            self._add_session(sess)
+            if self._handshake_timeout is not None:
+                self._set_timer(sess, self._now + self._handshake_timeout, self._expire_handshake)
+
+    def _expire_handshake(self, sess):
+        if self._metrics is not None:
+            self._metrics.handshake(sess, "timeout")
+        self._remove_session(sess)
+
+    def _expire_close(self, sess):
+        if self._metrics is not None:
+            self._metrics.close(sess, "close_timeout")
+        self._remove_session(sess)
+
+    # Drop a session without a closing handshake, counting why.
+    def _drop_session(self, sess, reason):
+        if self._metrics is not None:
+            self._metrics.close(sess, reason)
+        self._remove_session(sess)
+
+    # Sessions have a single timer, for whichever deadline applies to their state.
+    def _set_timer(self, sess, deadline, callback):
+        if sess._timer is not None:
+            self._timers.cancel(sess._timer)
+        sess._timer = self._timers.call_at(deadline, callback, sess) if deadline is not None else None
+
+    # Keepalive and idle deadlines of a connected session. Receiving data does not touch the timer,
+    # it only records the time: when the timer fires, it either acts or is pushed back to the next deadline.
+    def _check_session(self, sess):
+        now = self._now
+        if sess._reading_paused:
+            # the server is the one not listening, the client counts as alive and busy
+            sess._last_recv = sess._last_message = now
+        if self._idle_timeout is not None and now >= sess._last_message + self._idle_timeout:
+            self._close_handshake(sess, c.CloseGoingAway)
+            return
+        deadline = None
+        if self._ping_interval is not None:
+            if sess._ping_sent is not None and sess._last_recv < sess._ping_sent:
+                if self._ping_timeout is not None and now >= sess._ping_sent + self._ping_timeout:
+                    # the peer is gone
+                    self._drop_session(sess, "ping_timeout")
+                    return
+            elif now >= sess._last_recv + self._ping_interval:
+                sess._ping_sent = now
+                self._send_frame(sess, c.OpcodePing, b"")
+                if sess._state != c.StateConnected:
+                    return
+            if sess._ping_sent is not None and sess._last_recv < sess._ping_sent:
+                if self._ping_timeout is not None:
+                    deadline = sess._ping_sent + self._ping_timeout
+            else:
+                deadline = sess._last_recv + self._ping_interval
+        if self._idle_timeout is not None:
+            idle_deadline = sess._last_message + self._idle_timeout
+            deadline = idle_deadline if deadline is None else min(deadline, idle_deadline)
+        self._set_timer(sess, deadline, self._check_session)
+
+    # Queue a message on a session, compressed if the session uses permessage-deflate. With context takeover a
+    # message only inflates after the ones compressed before it, so it is compressed where it is queued, on the
+    # reactor thread: other threads hand the message itself over. Without it, compressing carries no state.
+    def _send_message(self, sess, opcode, data):
+        deflate = sess._deflate
+        if deflate is None or len(data) < deflate.threshold:
+            return self._send_frame(sess, opcode, data)
+        if deflate.shared_key is None and threading.get_ident() != self._thread_ident:
+            # admitted at its uncompressed size
+            with self._handoff_lock:
+                return self._hand_off(sess, None, (opcode, data), len(data))
+        return self._send_frame(sess, opcode, deflate.compress(data), rsv1=True)
+
+    # Queue a frame on a session, see _enqueue.
+    def _send_frame(self, sess, opcode, payload, rsv1=False):
+        if self._metrics is not None:
+            self._metrics.frame_out(sess, opcode, len(payload))
+        if self._cork and threading.get_ident() == self._thread_ident:
+            return self._enqueue_packed(sess, opcode, payload, rsv1)
+        return self._enqueue(sess, (encode_header(opcode, len(payload), rsv1=rsv1), payload))
+
+    # Queue buffers on a session and write out as much as the socket takes right away (or at the end of
+    # the loop iteration, when corking). Send queues are only touched by the reactor thread: other threads
+    # hand the buffers over through the self-pipe, so that the frames of concurrent senders are never mixed.
+    def _enqueue(self, sess, buffers):
+        if threading.get_ident() != self._thread_ident:
+            with self._handoff_lock:
+                return self._hand_off(sess, buffers, None, sum(map(len, buffers)))
+        if not self._admit(sess, sum(map(len, buffers))):
+            return False
+        for buffer in buffers:
+            sess._sendqueue.append(buffer)
+        self._queued(sess)
+        return True
+
+    # Pass framed buffers, or a (opcode, data) message still to be compressed, from another thread to the
+    # reactor, which queues them in the order they were handed over. Until then their `size` counts against
+    # the session's high-water mark. Called with the handoff lock held, returns whether the data was admitted.
+    def _hand_off(self, sess, buffers, message, size):
+        if not self._admit(sess, size):
+            return False
+        sess._handed_off += size
+        self._handoffs.append((sess, buffers, message, size))
+        self._notify_flush()
+        return True
+
+    # Queue what another thread handed over, on the reactor thread. It was admitted when it was handed over.
+    def _queue_handoff(self, sess, buffers, message):
+        if message is not None:
+            opcode, data = message
+            payload = sess._deflate.compress(data)
+            if self._metrics is not None:
+                self._metrics.frame_out(sess, opcode, len(payload))
+            buffers = (encode_header(opcode, len(payload), rsv1=True), payload)
+        for buffer in buffers:
+            sess._sendqueue.append(buffer)
+        self._queued(sess, batched=True)
+
+    # Queue a frame from the reactor thread while corking: the header, and the payload too if it is small,
+    # are written straight into the send queue's packing buffer.
+    def _enqueue_packed(self, sess, opcode, payload, rsv1):
+        length = len(payload)
+        size = header_size(length)
+        if not self._admit(sess, size + length):
+            return False
+        queue = sess._sendqueue
+        packed = length <= self.PACK_SIZE
+        buffer, offset = queue.reserve(size + length if packed else size)
+        end = encode_header_into(buffer, offset, opcode, length, rsv1=rsv1)
+        if packed:
+            buffer[end:end + length] = payload
+            queue.commit(size + length)
+        else:
+            queue.commit(size)
+            queue.append(payload)
+        self._queued(sess)
+        return True
+
+    # Apply the overflow policy to `size` more bytes for a session, returns whether they may be queued.
+    def _admit(self, sess, size):
+        if sess._state == c.StateClosed or sess._close_requested:
+            return False
+        if len(sess._sendqueue) + sess._handed_off - sess._handed_queued + size > self._write_high:
+            if self._overflow_policy == "drop":
+                return False
+            if self._overflow_policy == "close":
+                if self._metrics is not None:
+                    self._metrics.close(sess, "overflow")
+                if threading.get_ident() == self._thread_ident:
+                    self._remove_session(sess)
+                else:
+                    sess._close_requested = True
+                    self._request_flush(sess)
+                return False
+            if not sess._writing_paused:
+                sess._writing_paused = True
+                if self._on_pause_writing is not None:
+                    self._on_pause_writing(sess)
+        return True
+
+    # Write out (or cork) a send queue that just got data. `batched`: the data was handed over by another thread,
+    # and more for the same session may follow in the batch, so the queue is written out once it is all queued.
+    def _queued(self, sess, batched=False):
+        if self._metrics is not None:
+            self._metrics.queue_depth.observe(len(sess._sendqueue))
+        if batched and not self._cork:
+            if not sess._flush_scheduled:
+                sess._flush_scheduled = True
+                self._flush_requests.append(sess)
+        elif not self._cork or len(sess._sendqueue) >= self._cork_size:
+            sess._cork_deadline = None
+            self._flush(sess)
+        elif sess._cork_deadline is None:
+            sess._cork_deadline = self._now + self._cork_delay
+            self._corked.append((sess._cork_deadline, sess))
+
+    # Write out the corked send queues that are due, returns how long the next one may still wait (or None).
+    def _flush_corked(self):
+        corked = self._corked
+        while corked:
+            deadline, sess = corked[0]
+            if sess._cork_deadline != deadline:
+                # flushed since (or corked again, with a later deadline)
+                corked.popleft()
+            elif deadline > self._now:
+                return deadline - self._now
+            else:
+                corked.popleft()
+                sess._cork_deadline = None
+                self._flush(sess)
+        return None
+
+    def _request_flush(self, sess):
+        if not sess._flush_scheduled:
+            sess._flush_scheduled = True
+            self._flush_requests.append(sess)
+            self._notify_flush()
+
+    # Wake the reactor up to take what other threads left in _handoffs, _close_requests and _flush_requests.
+    # One "flush" through the self-pipe covers every request queued until the reactor picks it up,
+    # so that a broadcast from another thread does not cost a pipe message per session.
+    def _notify_flush(self):
+        if not self._flush_notified:
+            self._flush_notified = True
+            self._pipefd1.send("flush")
+
+    # Close a session on the application's request, see WebsocketSession.close. Other threads leave the request
+    # to the reactor, which takes it after the frames they handed over before.
+    def _close_session(self, sess, code):
+        if threading.get_ident() != self._thread_ident:
+            self._close_requests.append((sess, code))
+            self._notify_flush()
+        elif sess._state == c.StateConnected:
+            self._close_handshake(sess, code)
+        elif sess._state == c.StateUnconnected:
+            self._remove_session(sess)
+
+    # Write out a session's send queue, and watch the socket for writability while data is left.
+    def _flush(self, sess):
+        if sess._state == c.StateClosed:
+            return
+        if sess._close_requested:
+            self._remove_session(sess)
+            return
+        queue = sess._sendqueue
+        nbytes, error = queue.flush(sess._sock)
+        if self._metrics is not None:
+            self._metrics.sent(sess, nbytes)
+        if error == io.e.ErrorStreamClosed:
+            self._drop_session(sess, "send_error")
+            return
+        if error == io.e.ErrorStreamFull:
+            if sess._fileno not in self._writers:
+                self._writers.add(sess._fileno)
+                self._update_events(sess)
+        else:
+            if sess._fileno in self._writers:
+                self._writers.discard(sess._fileno)
+                self._update_events(sess)
+            if sess._state == c.StageClosing and sess._close_received:
+                # the close frame answering the client's is out
+                self._remove_session(sess)
+                return
+        if sess._writing_paused and len(queue) <= self._write_low:
+            sess._writing_paused = False
+            if self._on_resume_writing is not None:
+                self._on_resume_writing(sess)
+
+    # Hand a received message (or message chunk when streaming) to the application.
+    def _deliver(self, sess, opcode, data, final):
+        sess._last_message = self._now
+        if self._on_message_chunk is not None:
+            if self._executor is not None and isinstance(data, memoryview):
+                data = bytes(data)
+            self._dispatch(sess, self._on_message_chunk, data, final)
+        elif self._on_message is not None:
+            self._dispatch(sess, self._on_message, data)
+
+    # Run an application callback for a session: right away without an executor, otherwise queued behind
+    # the session's other callbacks, as only one of them runs on the executor at a time.
+    def _dispatch(self, sess, callback, *args):
+        if self._executor is None:
+            if self._metrics is not None:
+                start = time.perf_counter()
+            try:
+                callback(sess, *args)
+            except Exception:
+                traceback.print_exc()
+                self._handler_failed(sess)
+            if self._metrics is not None:
+                self._metrics.callback_time.observe(time.perf_counter() - start)
+            return
+        if sess._handlers is None:
+            sess._handlers = collections.deque()
+        sess._handlers.append((callback, args))
+        if not sess._handler_busy:
+            self._submit_handler(sess)
+        elif len(sess._handlers) >= self._max_pending and not sess._reading_paused and sess._state != c.StateClosed:
+            sess._reading_paused = True
+            self._update_events(sess)
+
+    def _submit_handler(self, sess):
+        callback, args = sess._handlers.popleft()
+        sess._handler_busy = True
+        if self._process_executor:
+            future = self._executor.submit(callback, sess._address, *args)
+        elif self._metrics is not None:
+            future = self._executor.submit(self._timed, callback, sess, *args)
+        else:
+            future = self._executor.submit(callback, sess, *args)
+        future.add_done_callback(functools.partial(self._handler_done, sess))
+        if sess._reading_paused and len(sess._handlers) <= self._max_pending // 2 and sess._state != c.StateClosed:
+            sess._reading_paused = False
+            self._update_events(sess)
+
+    def _timed(self, callback, *args):
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            self._metrics.callback_time.observe(time.perf_counter() - start)
+
+    # Called on the executor's thread when a callback is finished: the reactor takes it from there.
+    def _handler_done(self, sess, future):
+        self._handlers_done.append((sess, future))
+        if not self._handlers_notified:
+            self._handlers_notified = True
+            self._pipefd1.send("handlers")
+
+    def _finish_handler(self, sess, future):
+        sess._handler_busy = False
+        error = future.exception()
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self._handler_failed(sess)
+        elif self._process_executor and future.result() is not None:
+            sess.send(future.result())
+        if sess._handlers:
+            self._submit_handler(sess)
+
+    def _handler_failed(self, sess):
+        if sess._state == c.StateConnected:
+            self._close_handshake(sess, c.CloseInternalError)
+
+    # Answer (or start) the closing handshake: send a close frame with `code`. When answering, the connection
+    # is closed as soon as the send queue is written out, otherwise once the client's close frame arrives.
+    def _close_handshake(self, sess, code):
+        if sess._state == c.StateConnected:
+            sess._state = c.StageClosing
+            if self._metrics is not None:
+                self._metrics.close(sess, code)
+            if self._close_timeout is not None:
+                self._set_timer(sess, self._now + self._close_timeout, self._expire_close)
+            self._send_frame(sess, c.OpcodeClose, code.to_bytes(2, "big"))
+        else:
+            # the client answers a close frame we sent
+            self._remove_session(sess)
+
+    def _threadfn(self):
+        self._thread_ident = threading.get_ident()
+        metrics = self._metrics
+        stopped = False
+        while not stopped:
+            # Timers decide how long the loop may sleep: it blocks until the nearest deadline, or
+            # until the self-pipe or a socket wakes it up.
+            self._now = time.monotonic()
+            self._timers.expire(self._now)
+            timeout = self._timers.timeout(self._now)
+            if self._corked:
+                # frames queued while handling the previous events (or expiring timers) go out now
+                delay = self._flush_corked()
+                if delay is not None and (timeout is None or delay < timeout):
+                    timeout = delay
+            if metrics is not None:
+                busy = time.monotonic() - self._now
+            ready = self._selector.select(timeout)
+            self._now = time.monotonic()
+            for key, events in ready:
+                if key.fileobj is self._pipefd2:
+                    # self-pipe
+                    command = self._pipefd2.recv()
+                    if command == "flush":
+                        self._flush_notified = False
+                        while self._handoffs:
+                            sess, buffers, message, size = self._handoffs.popleft()
+                            # nothing may follow the close frame
+                            if sess._state == c.StateConnected and not sess._close_requested:
+                                self._queue_handoff(sess, buffers, message)
+                            sess._handed_queued += size
+                        while self._close_requests:
+                            self._close_session(*self._close_requests.popleft())
+                        while self._flush_requests:
+                            sess = self._flush_requests.popleft()
+                            sess._flush_scheduled = False
+                            self._flush(sess)
+                        continue
+                    if command == "handlers":
+                        self._handlers_notified = False
+                        while self._handlers_done:
+                            self._finish_handler(*self._handlers_done.popleft())
+                        continue
+                    if command == "drain":
+                        if self._socket.fileno() >= 0:
+                            self._selector.unregister(self._socket)
+                            self._socket.close()
+                        continue
+                    stopped = True
+                    break
+                elif key.fileobj is self._socket:
+                    # a client is requesting for connecting
+                    self._accept()
+                else:
+                    sess = key.data
+                    if events & selectors.EVENT_WRITE:
+                        # the socket can take more of the send queue
+                        self._flush(sess)
+                    if events & selectors.EVENT_READ and sess._state != c.StateClosed:
+                        # a client has sent some data to us
+                        self._handle_read(sess)
+            if metrics is not None:
+                # busy time: expiring the timers, then handling the events
+                metrics.loop_time.observe(busy + time.monotonic() - self._now)
+
+    def _handle_read(self, sess):
+        # Drain the socket into the session's receive buffer with a single syscall, then consume
+        # as many protocol items (upgrade request, frames) as it holds.
+        # The selector is level-triggered, so whatever does not fit now will be reported again.
+        nbytes, error = sess._recvbuf.fill(sess._sock)
+        if error == io.e.ErrorStreamEmpty:
+            return
+        sess._last_recv = self._now
+        # If no bytes can be received for this client event, the socket should be closed.
+        if error == io.e.ErrorStreamClosed:
+            self._drop_session(sess, "eof")
+            return
+        if self._metrics is not None:
+            self._metrics.received(sess, nbytes)
+        while sess._state != c.StateClosed and self._handle_data(sess):
+            pass
+        # everything has been consumed (or copied) unless a request or frame header is incomplete
+        sess._recvbuf.release()
+
+    # Consume one protocol item (the upgrade request, or frames) from the receive buffer,
+    # returns whether anything was consumed.
+    def _handle_data(self, sess):
+        buf = sess._recvbuf
+        # Until the connection is established, the buffer holds (part of) the HTTP upgrade request.
+        if sess._state == c.StateUnconnected:
+            response, accepted = handshake.process(sess, buf, self._buffer_size, self._deflate)
+            if response is None:
+                return False
+            if self._metrics is not None:
+                self._metrics.handshake(sess, int(response[9:12]))
+            if not accepted:
+                # best effort, the connection is closed right away
+                try:
+                    sess._sock.send(response)
+                except OSError:
+                    pass
+                self._remove_session(sess)
+                return False
+            sess._last_message = self._now
+            self._check_session(sess)
+            streaming = self._on_message_chunk is not None
+            sess._parser = FrameParser(max_frame_size=None if streaming else self._max_frame_size, streaming=streaming,
+                                       pool=self._pool)
+            sess._assembler = MessageAssembler(self._max_message_size, streaming, sess._deflate)
+            self._enqueue(sess, (response,))
+            if self._on_connect is not None:
+                self._dispatch(sess, self._on_connect)
+            return True
+        # If we are in Connected State, we parse data with websocket protocol.
+        # Everything received so far is fed to the frame parser at once. Payloads of the frames it returns
+        # may point into the receive buffer, so they must be handled before the buffer is filled again.
+        data, _ = buf.read_all()
+        if sess._close_received:
+            # answering the client's close: whatever it still sends is dropped
+            return False
+        metrics = self._metrics
+        try:
+            for frame in sess._parser.feed(data):
+                if metrics is not None and frame.payload_complete:
+                    # streamed frames are counted with their last piece
+                    metrics.frame_in(sess, frame.opcode, frame.payload_length)
+                sess._complete_frame(frame)
+                if sess._state == c.StateClosed or sess._close_received:
+                    break
+        except ProtocolError as error:
+            self._close_handshake(sess, error.code)
+        return False
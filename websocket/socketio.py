@@ -1,40 +1,235 @@
-from .const import Constants
-
-class ErrorConsts(Constants):
-    NoError = 0
-    ErrorBufferOverflow = 1
-    ErrorStreamEmpty = 2
-
-ErrorConsts = ErrorConsts()
-e = Errors = ErrorConsts
-
-error = e.Success
-
-def recv_line(sock, maxlen, _dirty_data=b""):
-    global error
-    buffer = bytearray(maxlen)
-    buffer[:len(_dirty_data)] = _dirty_data
-    for i in range(len(_dirty_data), len(buffer)):
-        thebyte = sock.recv(1)
-        if len(thebyte) == 0:
-            error = e.ErrorBufferOverflow
-            return bytes(buffer[:i])
-        buffer[i] = thebyte
-        if buffer[-2:] == b"\r\n":
-            error = e.NoError
-            return bytes(buffer[:i+1])
-    error = e.ErrorBufferOverflow
-    return bytes(buffer)
-
-def recv_bytes(sock, len, _dirty_data=b""):
-    global error
-    buffer = bytearray(len)
-    buffer[:len(_dirty_data)] = _dirty_data
-    for i in range(len(_dirty_data), len(buffer)):
-        thebyte = sock.recv(1)
-        if len(thebyte) == 0:
-            error = e.ErrorStreamEmpty
-            return bytes(buffer[:i])
-        buffer[i] = thebyte
-    error = e.NoError
-    return bytes(buffer)
\ No newline at end of file
+import collections, itertools
+
+from .const import Constants
+
+class ErrorConsts(Constants):
+    NoError = 0
+    ErrorBufferOverflow = 1
+    ErrorStreamEmpty = 2
+    ErrorStreamClosed = 3
+    ErrorStreamFull = 4
+
+ErrorConsts = ErrorConsts()
+e = Errors = ErrorConsts
+
+# Receive buffer of a session.
+# The socket is drained with large `recv_into` calls into one reusable bytearray, and lines or
+# fixed-length fields are then taken out of it by moving the read offset, so no data is copied
+# or re-sliced until the caller actually asks for it.
+# Every read method returns a `(result, error)` pair, so no error state is shared between calls.
+# The bytearray is only allocated when data is about to be received, from `pool` (a BufferPool) if given,
+# and release() gives it back once everything has been consumed, so idle sessions hold no buffer.
+class RecvBuffer:
+    __slots__ = ("_size", "_pool", "_buffer", "_view", "_start", "_end")
+
+    def __init__(self, size=65536, pool=None):
+        self._size = size
+        self._pool = pool
+        self._buffer = None
+        self._view = None
+        self._start = 0 # offset of the first unread byte
+        self._end = 0 # offset after the last received byte
+
+    def __len__(self):
+        return self._end - self._start
+
+    # Drop the bytearray if no unread data is left in it. Views of it handed out before must not be used anymore.
+    def release(self):
+        if self._buffer is None or self._start != self._end:
+            return
+        if self._pool is not None:
+            self._pool.release(self._buffer)
+        self._buffer = self._view = None
+        self._start = self._end = 0
+
+    def _compact(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start > 0:
+            length = self._end - self._start
+            self._buffer[:length] = self._view[self._start:self._end]
+            self._start, self._end = 0, length
+
+    # The free space at the end of the buffer, compacting it first if the end has been reached.
+    # Returns None if the buffer is full of unread data.
+    def writable(self):
+        if self._buffer is None:
+            self._buffer = self._pool.acquire(self._size) if self._pool is not None else bytearray(self._size)
+            self._view = memoryview(self._buffer)[:self._size]
+        if self._end == self._size:
+            self._compact()
+            if self._end == self._size:
+                return None
+        return self._view[self._end:]
+
+    # Mark `nbytes` bytes written into `writable()` as received.
+    def advance(self, nbytes):
+        self._end += nbytes
+
+    # Receive as much as fits into the free space with a single syscall.
+    # Returns (number of bytes received, error).
+    def fill(self, sock):
+        view = self.writable()
+        if view is None:
+            return 0, e.ErrorBufferOverflow
+        try:
+            nbytes = sock.recv_into(view)
+        except (BlockingIOError, InterruptedError):
+            return 0, e.ErrorStreamEmpty
+        except ConnectionError:
+            return 0, e.ErrorStreamClosed
+        if nbytes == 0:
+            return 0, e.ErrorStreamClosed
+        self._end += nbytes
+        return nbytes, e.NoError
+
+    # Take everything up to and including `delimiter`, at most `maxlen` bytes.
+    def read_until(self, delimiter, maxlen):
+        if self._buffer is None:
+            return None, e.ErrorStreamEmpty
+        idx = self._buffer.find(delimiter, self._start, self._end)
+        if idx < 0:
+            if self._end - self._start >= maxlen:
+                return None, e.ErrorBufferOverflow
+            self._compact()
+            return None, e.ErrorStreamEmpty
+        end = idx + len(delimiter)
+        if end - self._start > maxlen:
+            return None, e.ErrorBufferOverflow
+        data = bytes(self._view[self._start:end])
+        self._start = end
+        if self._start == self._end:
+            self._start = self._end = 0
+        return data, e.NoError
+
+    # Take a CRLF-terminated line (terminator included) of at most `maxlen` bytes.
+    def read_line(self, maxlen):
+        return self.read_until(b"\r\n", maxlen)
+
+    # Take exactly `length` bytes, or nothing if they have not all been received yet.
+    def read_bytes(self, length):
+        if self._end - self._start < length:
+            self._compact()
+            return None, e.ErrorStreamEmpty
+        data = bytes(self._view[self._start:self._start + length])
+        self._start += length
+        return data, e.NoError
+
+    # Move up to len(view) bytes into a writable buffer, returns the number of bytes moved.
+    def read_into(self, view):
+        length = min(len(view), self._end - self._start)
+        if length == 0:
+            return 0, e.NoError
+        view[:length] = self._view[self._start:self._start + length]
+        self._start += length
+        if self._start == self._end:
+            self._start = self._end = 0
+        return length, e.NoError
+
+    # Take everything received so far, as a view that stays valid until the next fill or release.
+    def read_all(self):
+        if self._buffer is None:
+            return b"", e.NoError
+        data = self._view[self._start:self._end]
+        self._start = self._end = 0
+        return data, e.NoError
+
+# Send queue of a session.
+# Buffers are queued as memoryviews without copying them (so they must not be modified once queued),
+# and flushed with `sendmsg`, which writes several of them (e.g. a frame header and its payload)
+# in a single syscall. A partially sent buffer is replaced by a view of its unsent tail.
+# Small writes can instead be packed one after the other into a tail buffer (see reserve()), so that many
+# small frames go out as one contiguous buffer rather than an I/O vector entry each. The tail buffer is taken
+# from `pool` (a BufferPool) if given, and given back once the queue has been written out.
+# A send queue is not thread-safe: it must only be used by one thread (the server's reactor), as the deque
+# and the packing buffer are dropped as soon as the queue is empty, to keep idle sessions small.
+class SendQueue:
+    __slots__ = ("_buffers", "_size", "_pool", "_tail", "_tail_start", "_tail_end")
+    IOV_MAX = 64 # buffers passed to a single sendmsg call
+    TAIL_SIZE = 16384
+
+    def __init__(self, pool=None):
+        self._buffers = None # deque while data is queued (an empty deque takes ~600 bytes)
+        self._size = 0 # number of queued bytes
+        self._pool = pool
+        self._tail = None # bytearray small writes are packed into
+        self._tail_start = 0 # start of the packed bytes not in _buffers yet
+        self._tail_end = 0 # end of the packed bytes
+
+    def __len__(self):
+        return self._size
+
+    def append(self, buffer):
+        view = buffer if isinstance(buffer, memoryview) else memoryview(buffer)
+        if view.format != "B":
+            view = view.cast("B")
+        if len(view) > 0:
+            self._seal()
+            if self._buffers is None:
+                self._buffers = collections.deque()
+            self._buffers.append(view)
+            self._size += len(view)
+
+    # Room for `size` more bytes at the end of the queue: returns `(buffer, offset)`, the caller writes the
+    # bytes into buffer[offset:offset + size] and then calls commit(size).
+    def reserve(self, size):
+        tail = self._tail
+        if tail is None or self._tail_end + size > len(tail):
+            # a full tail buffer stays referenced by its queued views until they are sent
+            self._seal()
+            size = max(size, self.TAIL_SIZE)
+            self._tail = tail = self._pool.acquire(size) if self._pool is not None else bytearray(size)
+            self._tail_start = self._tail_end = 0
+        return tail, self._tail_end
+
+    def commit(self, size):
+        self._tail_end += size
+        self._size += size
+
+    # Queue the bytes packed into the tail buffer since the last call.
+    def _seal(self):
+        if self._tail_end > self._tail_start:
+            if self._buffers is None:
+                self._buffers = collections.deque()
+            self._buffers.append(memoryview(self._tail)[self._tail_start:self._tail_end])
+            self._tail_start = self._tail_end
+
+    def clear(self):
+        self._buffers = None
+        self._size = 0
+        self._tail = None
+        self._tail_start = self._tail_end = 0
+
+    # Send queued data until the queue is empty or the socket cannot take more.
+    # Returns (number of bytes sent, error), error is ErrorStreamFull if data is left in the queue.
+    def flush(self, sock):
+        total = 0
+        self._seal()
+        buffers = self._buffers
+        if buffers is None:
+            return total, e.NoError
+        while buffers:
+            try:
+                nbytes = sock.sendmsg(list(itertools.islice(buffers, self.IOV_MAX)))
+            except (BlockingIOError, InterruptedError):
+                return total, e.ErrorStreamFull
+            except OSError:
+                return total, e.ErrorStreamClosed
+            total += nbytes
+            self._size -= nbytes
+            while nbytes > 0:
+                buffer = buffers[0]
+                if len(buffer) > nbytes:
+                    # the socket buffer is full, no need to find it out with another syscall
+                    buffers[0] = buffer[nbytes:]
+                    return total, e.ErrorStreamFull
+                nbytes -= len(buffer)
+                buffers.popleft()
+        self._buffers = None
+        if self._tail is not None:
+            # nothing refers to the tail buffer anymore
+            if self._pool is not None:
+                self._pool.release(self._tail)
+            self._tail = None
+            self._tail_start = self._tail_end = 0
+        return total, e.NoError
@@ -0,0 +1,91 @@
+import math
+
+# Hashed timer wheel for the reactor loop.
+# Time is cut into ticks of `resolution` seconds and every timer is filed under the tick of its deadline
+# (rounded up, so a timer never fires early). Slots are kept in a dict by absolute tick number, so the wheel
+# has no fixed size and deadlines far in the future need no cascading: scheduling and cancelling a timer
+# are O(1), and expiring them costs O(1) per timer plus one dict lookup per elapsed tick.
+#
+#     timers = TimerWheel()
+#     timer = timers.call_later(now, 30, callback, arg)
+#     timers.cancel(timer)
+#     ...
+#     timers.expire(time.monotonic())
+#     events = selector.select(timers.timeout(time.monotonic()))
+
+class Timer:
+    __slots__ = ("tick", "callback", "args")
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+
+class TimerWheel:
+    HORIZON = 64 # ticks looked ahead for the next deadline, beyond that the loop just wakes up once more
+
+    # resolution: length of a tick, in seconds
+    def __init__(self, resolution=0.1):
+        self._resolution = resolution
+        self._slots = {} # tick -> {Timer: None}
+        self._tick = None # last expired tick
+
+    def __len__(self):
+        return sum(map(len, self._slots.values()))
+
+    def _now_tick(self, now):
+        return math.floor(now / self._resolution)
+
+    # Schedule `callback(*args)` to be called once the monotonic clock reaches `deadline`.
+    def call_at(self, deadline, callback, *args):
+        tick = math.ceil(deadline / self._resolution)
+        if self._tick is not None and tick <= self._tick:
+            tick = self._tick + 1
+        timer = Timer(tick, callback, args)
+        slot = self._slots.get(tick)
+        if slot is None:
+            slot = self._slots[tick] = {}
+        slot[timer] = None
+        return timer
+
+    def call_later(self, now, delay, callback, *args):
+        return self.call_at(now + delay, callback, *args)
+
+    # Cancelling a timer that already fired (or was cancelled) does nothing.
+    def cancel(self, timer):
+        slot = self._slots.get(timer.tick)
+        if slot is not None and slot.pop(timer, False) is None and not slot:
+            del self._slots[timer.tick]
+
+    # Call the callbacks of every timer due at `now`. Callbacks may schedule and cancel timers.
+    def expire(self, now):
+        end = self._now_tick(now)
+        start = end if self._tick is None else self._tick + 1
+        self._tick = end
+        if start > end or not self._slots:
+            return
+        if end - start >= len(self._slots):
+            # after a long sleep, it is cheaper to look at the occupied slots than at every elapsed tick
+            ticks = sorted(tick for tick in self._slots if tick <= end)
+        else:
+            ticks = range(start, end + 1)
+        for tick in ticks:
+            # the slot stays in place while its timers fire, so that callbacks can cancel the ones left
+            slot = self._slots.get(tick)
+            while slot:
+                timer, _ = slot.popitem()
+                timer.callback(*timer.args)
+            self._slots.pop(tick, None)
+
+    # Seconds until the next deadline, for the poll timeout: None if no timer is pending.
+    def timeout(self, now):
+        if not self._slots:
+            return None
+        current = self._now_tick(now)
+        if len(self._slots) <= self.HORIZON:
+            tick = min(self._slots)
+        else:
+            for tick in range(current + 1, current + self.HORIZON + 1):
+                if tick in self._slots:
+                    break
+        return max(0, tick * self._resolution - now)
@@ -0,0 +1,83 @@
+import multiprocessing, signal, time, os
+
+from .server import WebsocketServer
+
+# Pre-fork worker pool.
+# Every worker process runs its own server (and so its own event loop) with its own SO_REUSEPORT
+# listener on the same address, and the kernel spreads incoming connections across them, so
+# connection handling scales over the cores instead of being bound to one reactor thread.
+# The parent talks to each worker over a pipe, to collect session counts and to shut them down.
+#
+#     pool = WorkerPool(workers=4)
+#     pool.start("0.0.0.0", 8080)
+#     ...
+#     pool.close(timeout=10)
+
+def _worker_main(conn, server_factory, address, port, backlog):
+    # The parent decides when workers stop, Ctrl-C must not kill them halfway through a drain.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = server_factory()
+    server.listen(address, port, backlog=backlog, reuse_port=True)
+    conn.send(os.getpid())
+    while True:
+        command = conn.recv()
+        if command == "count":
+            conn.send(len(server.sessions))
+        elif command == "drain":
+            server.drain()
+            conn.send(None)
+        elif command == "close":
+            server.close()
+            conn.send(None)
+            return
+
+class WorkerPool:
+    # workers: number of worker processes, one per CPU by default
+    # server_factory: callable creating the server of a worker, called inside the worker process
+    # backlog: listen backlog of every worker's listener
+    def __init__(self, workers=None, server_factory=WebsocketServer, backlog=128):
+        self._workers = workers or os.cpu_count() or 1
+        self._server_factory = server_factory
+        self._backlog = backlog
+        self._processes = []
+        self._conns = []
+
+    def start(self, address="0.0.0.0", port=8080):
+        for _ in range(self._workers):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker_main, daemon=True,
+                args=(child_conn, self._server_factory, address, port, self._backlog))
+            process.start()
+            self._processes.append(process)
+            self._conns.append(conn)
+        # wait until every worker listens
+        for conn in self._conns:
+            conn.recv()
+
+    def _command(self, command):
+        for conn in self._conns:
+            conn.send(command)
+        return [conn.recv() for conn in self._conns]
+
+    # Number of sessions of every worker.
+    def session_counts(self):
+        return self._command("count")
+
+    @property
+    def session_count(self):
+        return sum(self.session_counts())
+
+    # Gracefully shut the pool down: all workers stop accepting, the established sessions get up to
+    # `timeout` seconds to finish, then the remaining sessions are closed and the workers exit.
+    def close(self, timeout=0):
+        if not self._processes:
+            return
+        self._command("drain")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self.session_count > 0:
+            time.sleep(0.1)
+        self._command("close")
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._conns = []